@@ -1,21 +1,24 @@
 import asyncio
+import heapq
+import json
 import logging
 import uuid
 from contextlib import asynccontextmanager
 import datetime
-from typing import Annotated
+from typing import Annotated, Literal
 
 import ollama
 import opentelemetry.trace
-import pika
-from fastapi import FastAPI, UploadFile, HTTPException, Depends
+from fastapi import FastAPI, UploadFile, HTTPException, Depends, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from psycopg.rows import dict_row
+from pydantic import TypeAdapter, ValidationError
 from psycopg_pool import AsyncConnectionPool
 
 from .config import Settings
-from .models import Formula, FormulaInDb, JobStatus
-from .utils import require
+from .models import Formula, FormulaInDb, JobStatus, CompareResponse, Similarity, Page, Duplicate
+from .utils import require, escape_like
 from prometheus_client import make_asgi_app
 from opentelemetry import trace
 from .logging_config import (
@@ -25,7 +28,15 @@ from .logging_config import (
     DBQueryTimer,
     log_rabbitmq_message,
 )
-from .compare_functions import percent, find_indexes
+from .amqp import Publisher
+from .cache import CanonicalCache, ResultCache, normalize_latex
+from .canonical import Backfill, canonicalize_many
+from .compare_functions import prepare_formula
+from .engine import ComparisonEngine, ComparisonTimeout
+from .events import JobEvents
+from .index import FormulaIndex, find_indexes_many, percent_many, find_indexes_latex_many
+from .replica import configure as configure_replica, top_percent_shard, duplicates_shard, ReplicaNotReady
+from .spool import spool_upload
 
 settings = Settings()
 
@@ -37,13 +48,52 @@ async def lifespan(_app: FastAPI):
         assert (
                 settings.ai_pdf_queue is not None
         ), "AI workers require queue to be specified"
-        app.client: ollama.Client = ollama.Client(settings.ollama_dsn)
+        app.client = ollama.AsyncClient(settings.ollama_dsn)
+        app.llm_semaphore = asyncio.Semaphore(settings.ollama_concurrency)
         if settings.ollama_model:
             await asyncio.sleep(10)
-            app.client.pull(settings.ollama_model)
+            await app.client.pull(settings.ollama_model)
+        app.publisher = Publisher(settings.amqp_dsn.unicode_string(), settings.amqp_channel_pool_size)
+        await app.publisher.start()
     app.async_pool = AsyncConnectionPool(settings.postgres_dsn.unicode_string(), max_size=settings.postgres_pool_size)
+    app.engine = ComparisonEngine(
+        settings.comparison_workers,
+        settings.comparison_chunk_size,
+        settings.comparison_timeout,
+        configure_replica,
+        (
+            settings.postgres_dsn.unicode_string(),
+            settings.lsh_bands,
+            settings.lsh_rows,
+            settings.lsh_shingle,
+            settings.canonical_snapshot or None,
+        ),
+    )
+    await app.engine.start()
+    app.canonical_cache = CanonicalCache(
+        app.engine,
+        app.async_pool,
+        settings.canonical_cache_size,
+        settings.canonical_cache_shared,
+    )
+    app.result_cache = ResultCache(settings.response_cache_size, settings.response_cache_ttl)
+    app.backfill = Backfill(
+        app.async_pool,
+        ComparisonEngine(settings.backfill_workers, settings.comparison_chunk_size, settings.comparison_timeout),
+        settings.canonical_batch_size,
+    )
+    app.formula_index = FormulaIndex(settings.canonical_batch_size, app.engine, app.backfill)
+    app.job_events = JobEvents(settings.postgres_dsn.unicode_string())
+    app.job_events.start()
+    initial_refresh = asyncio.create_task(app.formula_index.refresh(app.async_pool))
     yield
+    initial_refresh.cancel()
+    await app.backfill.close()
+    await app.job_events.close()
+    app.engine.close()
     await app.async_pool.close()
+    if settings.ai_worker_enabled:
+        await app.publisher.close()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -56,8 +106,15 @@ app.add_middleware(
 )
 
 app.async_pool: AsyncConnectionPool
-
-pool = AsyncConnectionPool(settings.postgres_dsn.unicode_string(), max_size=settings.postgres_pool_size)
+app.engine: ComparisonEngine
+app.canonical_cache: CanonicalCache
+app.result_cache: ResultCache
+app.formula_index: FormulaIndex
+app.backfill: Backfill
+app.job_events: JobEvents
+app.publisher: Publisher
+app.client: ollama.AsyncClient
+app.llm_semaphore: asyncio.Semaphore
 
 app.middleware("http")(logging_middleware)
 
@@ -69,18 +126,6 @@ app.mount("/metrics", metrics_app)
 init_logging_and_tracing("backend", app)
 
 
-@require(
-    settings.amqp_dsn is not None and settings.ai_pdf_queue is not None,
-    "This is only available when AMQP specified.",
-)
-def rabbit_connection():
-    connection = pika.BlockingConnection(
-        pika.URLParameters(settings.amqp_dsn.unicode_string())
-    )
-    channel = connection.channel()
-    return connection, channel
-
-
 def get_logger():
     return config_get_logger(__name__)
 
@@ -90,37 +135,199 @@ def get_tracer():
 Logger = Annotated[logging.Logger, Depends(get_logger)]
 Tracer = Annotated[opentelemetry.trace.Tracer, Depends(get_tracer)]
 
-@app.get("/formulas")
-async def get_formulas(logger: Logger, tracer: Tracer) -> list[FormulaInDb]:
+
+async def catalogue_version() -> int:
+    with DBQueryTimer("select"):
+        async with app.async_pool.connection() as conn:
+            cur = await conn.execute("SELECT version FROM catalogue")
+            return (await cur.fetchone())[0]
+
+
+def not_modified(request: Request, response: Response, version: int) -> bool:
+    """
+    Tag the response with the catalogue version and check whether the client already has it.
+
+    The version is read before the data, so a concurrent change can only make the tag older than
+    the content, which makes clients revalidate once more.
+    """
+    etag = f'W/"{version}"'
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
+    return etag in request.headers.get("if-none-match", "")
+
+
+async def stream_rows(query: str, params: tuple = ()):
     """
-    Retrieve all formulas from the database.
+    Fetch query results in batches through a server-side cursor.
 
-    :return: A list of FormulaInDb objects representing all formulas in the database.
+    :return: Async generator of row batches
     """
+    async with app.async_pool.connection() as conn:
+        async with conn.cursor(name=f"stream_{uuid.uuid4().hex}", row_factory=dict_row) as cur:
+            await cur.execute(query, params)
+            while rows := await cur.fetchmany(settings.stream_batch_size):
+                yield rows
+
+
+def ndjson_response(lines) -> StreamingResponse:
+    return StreamingResponse(lines, media_type="application/x-ndjson")
+
+@app.get("/formulas")
+async def get_formulas(
+        request: Request,
+        response: Response,
+        logger: Logger,
+        tracer: Tracer,
+        limit: Annotated[int, Query(ge=1, le=1000)] = 100,
+        after: int | None = None,
+        name: str | None = None,
+        source: str | None = None,
+) -> Page[FormulaInDb]:
+    """
+    Retrieve a page of formulas from the database, ordered by id.
+
+    :param limit: Maximal amount of formulas on the page.
+    :param after: Cursor returned as `next` by the previous page.
+    :param name: Only return formulas with names containing this substring (case-insensitive).
+    :param source: Only return formulas from this source.
+    :return: A page of FormulaInDb objects and the cursor of the next page, if there is one,
+        or an empty response with 304 status code if the catalogue did not change since the `ETag` sent in `If-None-Match`.
+    """
+    if not_modified(request, response, await catalogue_version()):
+        return Response(status_code=304, headers=response.headers)
+    conditions, params = ["id > %s"], [after or 0]
+    if name is not None:
+        conditions.append("name ILIKE %s")
+        params.append(f"%{escape_like(name)}%")
+    if source is not None:
+        conditions.append("source = %s")
+        params.append(source)
     with tracer.start_as_current_span("select_formulas"):
         with DBQueryTimer("select"):
             async with app.async_pool.connection() as conn:
                 cur = conn.cursor(row_factory=dict_row)
-                await cur.execute("SELECT id, name, latex, source, description FROM formulas")
+                await cur.execute(
+                    f"SELECT id, name, latex, source, description FROM formulas "
+                    f"WHERE {' AND '.join(conditions)} ORDER BY id LIMIT %s",
+                    (*params, limit + 1),
+                )
                 all = await cur.fetchall()
-    logger.info(f"Retrieved {len(all)} formulas from the database")
-    return list(map(FormulaInDb.model_validate, all))
+    logger.info(f"Retrieved {len(all[:limit])} formulas from the database")
+    return Page(
+        items=list(map(FormulaInDb.model_validate, all[:limit])),
+        next=all[limit - 1]["id"] if len(all) > limit else None,
+    )
 
 
-@app.get("/formulas/{id}")
-async def get_formula(formula_id: int, logger: Logger, tracer: Tracer):
+@app.get("/formulas/search")
+async def search_formulas(
+        logger: Logger,
+        tracer: Tracer,
+        q: str | None = None,
+        latex: str | None = None,
+        limit: Annotated[int, Query(ge=1, le=1000)] = 20,
+        after: Annotated[int, Query(ge=0)] = 0,
+) -> Page[FormulaInDb]:
+    """
+    Search formulas by text in their name and description and/or by LaTeX similarity, best matches first.
+
+    :param q: Full-text query over names and descriptions (web search syntax).
+    :param latex: LaTeX matched against stored formulas by trigram similarity.
+    :param limit: Maximal amount of formulas on the page.
+    :param after: Cursor returned as `next` by the previous page.
+    :return: A page of FormulaInDb objects and the cursor of the next page, if there is one.
+    :raises HTTPException: If neither `q` nor `latex` is given (422 status code).
+    """
+    conditions, ranks, params = [], [], {"limit": limit + 1, "offset": after}
+    if q:
+        conditions.append("search @@ websearch_to_tsquery('simple', %(q)s)")
+        ranks.append("ts_rank_cd(search, websearch_to_tsquery('simple', %(q)s))")
+        params["q"] = q
+    if latex:
+        conditions.append("latex %% %(latex)s")
+        ranks.append("similarity(latex, %(latex)s)")
+        params["latex"] = latex
+    if not conditions:
+        raise HTTPException(status_code=422, detail="Either `q` or `latex` is required")
+    with tracer.start_as_current_span("search_formulas"):
+        with DBQueryTimer("select"):
+            async with app.async_pool.connection() as conn:
+                cur = conn.cursor(row_factory=dict_row)
+                await cur.execute(
+                    f"SELECT id, name, latex, source, description FROM formulas "
+                    f"WHERE {' AND '.join(conditions)} "
+                    f"ORDER BY {' + '.join(ranks)} DESC, id LIMIT %(limit)s OFFSET %(offset)s",
+                    params,
+                )
+                found = await cur.fetchall()
+    logger.info(f"Found {len(found[:limit])} formulas")
+    return Page(
+        items=list(map(FormulaInDb.model_validate, found[:limit])),
+        next=after + limit if len(found) > limit else None,
+    )
+
+
+@app.get("/formulas/export")
+async def export_formulas() -> StreamingResponse:
+    """
+    Stream all formulas from the database as NDJSON, one FormulaInDb object per line.
+    """
+    async def lines():
+        async for rows in stream_rows("SELECT id, name, latex, source, description FROM formulas ORDER BY id"):
+            yield "".join(FormulaInDb.model_validate(row).model_dump_json() + "\n" for row in rows)
+    return ndjson_response(lines())
+
+
+@app.get("/formulas/duplicates")
+async def find_duplicates(tracer: Tracer, threshold: Annotated[float, Query(gt=0, le=100)] = 90) -> list[Duplicate]:
+    """
+    Find pairs of stored formulas whose canonical arrays are at least `threshold` percent similar.
+
+    Only pairs sharing a canonical token and whose similarity bound reaches the threshold are scored.
+    Pairs are searched by the processes of the comparison engine, each one in its shard of formula ids.
+
+    :return: Pairs of formula ids with their similarity percentage, most similar first.
+    :raises HTTPException: If the comparison takes longer than the configured timeout (504 status code),
+        or the comparison index is being loaded (503 status code).
+    """
+    with tracer.start_as_current_span("refresh_index"):
+        await app.formula_index.refresh(app.async_pool)
+    with tracer.start_as_current_span("score_pairs"):
+        try:
+            parts = await app.engine.shards(
+                duplicates_shard, app.formula_index.version, threshold, timeout=settings.duplicates_timeout
+            )
+        except ComparisonTimeout:
+            raise HTTPException(status_code=504, detail="Comparison timed out")
+        except ReplicaNotReady:
+            raise index_loading()
+    pairs = [pair for part in parts for pair in part]
+    return [
+        Duplicate(id=formula_id, other=other_id, percent=score)
+        for formula_id, other_id, score in sorted(pairs, key=lambda pair: pair[2], reverse=True)
+    ]
+
+
+@app.get("/formulas/{formula_id}")
+async def get_formula(formula_id: int, request: Request, response: Response, logger: Logger, tracer: Tracer) -> FormulaInDb:
     """
     Get a formula by its id.
 
-    :return: A FormulaInDb object containing the details of the formula.
-    :rtype: FormulaInDb
+    :return: A FormulaInDb object containing the details of the formula, or an empty response with
+        304 status code if the catalogue did not change since the `ETag` sent in `If-None-Match`.
+    :raises HTTPException: If the formula with the given ID is not found (404 status code).
     """
+    if not_modified(request, response, await catalogue_version()):
+        return Response(status_code=304, headers=response.headers)
     with tracer.start_as_current_span("get_formula"):
         with DBQueryTimer("select"):
             async with app.async_pool.connection() as conn:
                 cur = conn.cursor(row_factory=dict_row)
                 await cur.execute("SELECT id, name, latex, source, description FROM formulas WHERE id = %s", (formula_id,))
                 result = await cur.fetchone()
+    if result is None:
+        logger.info(f"Formula {formula_id} was not found in the database")
+        raise HTTPException(status_code=404)
     logger.info(f"Retrieved formula {formula_id} from the database")
     return FormulaInDb.model_validate(result)
 
@@ -130,33 +337,146 @@ async def create_formula(formula: Formula, tracer: Tracer, logger: Logger):
     """
     Create a new formula in the database.
     """
+    with tracer.start_as_current_span("canonicalize_formula"):
+        try:
+            canonical = await app.canonical_cache.get(formula.latex)
+        except ComparisonTimeout:
+            canonical = []
     with tracer.start_as_current_span("insert_formula"):
         with DBQueryTimer("insert"):
             async with app.async_pool.connection() as conn:
                 cur = conn.cursor(row_factory=dict_row)
                 await cur.execute(
-                    "INSERT INTO formulas(name, latex, source, description) VALUES (%s, %s, %s, %s)",
-                    (formula.name, formula.latex, formula.source, formula.description),
+                    "INSERT INTO formulas(name, latex, source, description, canonical) VALUES (%s, %s, %s, %s, %s)",
+                    (formula.name, formula.latex, formula.source, formula.description, canonical),
                 )
                 await conn.commit()
     logger.info(f"Created formula {formula.name} in the database")
 
 
+async def formula_batches(request: Request, size: int):
+    """
+    Parse formulas of a request body, either a JSON array or NDJSON, into batches.
+
+    NDJSON bodies are validated line by line while they are received, a JSON array is validated as a whole.
+
+    :return: Async generator of formula batches
+    :raises HTTPException: If a formula is not valid (422 status code).
+    """
+    if not request.headers.get("content-type", "").startswith("application/x-ndjson"):
+        try:
+            formulas = TypeAdapter(list[Formula]).validate_json(await request.body())
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        for start in range(0, len(formulas), size):
+            yield formulas[start:start + size]
+        return
+    batch, buffer, line_number = [], b"", 0
+
+    def parse(line: bytes):
+        try:
+            batch.append(Formula.model_validate_json(line))
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail=f"Line {line_number}: {e}")
+
+    async for chunk in request.stream():
+        *lines, buffer = (buffer + chunk).split(b"\n")
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                parse(line)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+    line_number += 1
+    if buffer.strip():
+        parse(buffer)
+    if batch:
+        yield batch
+
+
+@app.post("/formulas/batch")
+async def create_formulas(request: Request, tracer: Tracer, logger: Logger) -> list[int]:
+    """
+    Create many formulas in a single transaction.
+
+    The body is a JSON array of formulas or, with `application/x-ndjson` content type, one formula per line.
+    Formulas are canonicalized in the comparison engine in batches while the body is received, and copied
+    into the database at once afterwards, so that the transaction, which locks the catalogue version
+    for other writers, is not kept open while reading the body or waiting for the engine.
+    Formulas whose canonical form times out are stored without it and get it computed on the next index refresh.
+
+    :return: Ids of the created formulas in the order they were sent.
+    :raises HTTPException: If a formula is not valid (422 status code), nothing is created then.
+    """
+    rows = []
+    async for batch in formula_batches(request, settings.create_batch_size):
+        with tracer.start_as_current_span("canonicalize_formulas"):
+            try:
+                canonicals = await app.engine.map(canonicalize_many, [formula.latex for formula in batch])
+            except ComparisonTimeout:
+                canonicals = [None] * len(batch)
+        rows += zip(batch, canonicals)
+    with tracer.start_as_current_span("copy_formulas"):
+        with DBQueryTimer("insert"):
+            async with app.async_pool.connection() as conn:
+                cur = conn.cursor()
+                # Ids are reserved beforehand, since COPY can not return them
+                await cur.execute(
+                    "SELECT nextval(pg_get_serial_sequence('formulas', 'id')) FROM generate_series(1, %s)",
+                    (len(rows),),
+                )
+                ids = [row[0] for row in await cur.fetchall()]
+                async with cur.copy(
+                        "COPY formulas (id, name, latex, source, description, canonical) FROM STDIN"
+                ) as copy:
+                    copy.set_types(["int4", "text", "text", "text", "text", "text[]"])
+                    for formula_id, (formula, canonical) in zip(ids, rows):
+                        await copy.write_row(
+                            (formula_id, formula.name, formula.latex, formula.source, formula.description, canonical)
+                        )
+                await conn.commit()
+    logger.info(f"Created {len(ids)} formulas in the database")
+    return ids
+
+
 @app.get("/jobs")
-async def get_jobs(tracer: Tracer, logger: Logger) -> list[JobStatus]:
+async def get_jobs(
+        tracer: Tracer,
+        logger: Logger,
+        limit: Annotated[int, Query(ge=1, le=1000)] = 100,
+        after: int | None = None,
+        status: Literal["pnd", "prc", "suc", "err", "arc"] | None = None,
+        order: Literal["asc", "desc"] = "asc",
+) -> Page[JobStatus]:
     """
-    Retrieve all unarchived jobs from the database.
+    Retrieve a page of jobs from the database, ordered by id.
 
-    :return: A list of JobStatus objects representing all jobs in the database.
+    :param limit: Maximal amount of jobs on the page.
+    :param after: Cursor returned as `next` by the previous page.
+    :param status: Only return jobs with this status. Archived jobs are skipped unless requested.
+    :param order: Direction of the id order, `desc` returns the newest jobs first.
+    :return: A page of JobStatus objects and the cursor of the next page, if there is one.
     """
+    conditions, params = ["status = %s" if status is not None else "status != %s"], [status or "arc"]
+    if after is not None:
+        conditions.append("id > %s" if order == "asc" else "id < %s")
+        params.append(after)
     with tracer.start_as_current_span("select_jobs"):
         with DBQueryTimer("select"):
             async with app.async_pool.connection() as conn:
                 cur = conn.cursor(row_factory=dict_row)
-                await cur.execute("SELECT id, status, datetime FROM jobs WHERE status != 'arc'")
+                await cur.execute(
+                    f"SELECT id, status, datetime, pages_done, pages_total FROM jobs "
+                    f"WHERE {' AND '.join(conditions)} ORDER BY id {order} LIMIT %s",
+                    (*params, limit + 1),
+                )
                 jobs = await cur.fetchall()
-    logger.info(f"Retrieved {len(jobs)} jobs from the database")
-    return list(map(lambda x: JobStatus(**x), jobs))
+    logger.info(f"Retrieved {len(jobs[:limit])} jobs from the database")
+    return Page(
+        items=list(map(lambda x: JobStatus(**x), jobs[:limit])),
+        next=jobs[limit - 1]["id"] if len(jobs) > limit else None,
+    )
 
 
 @app.get("/jobs/status/{job_id}")
@@ -171,7 +491,7 @@ async def get_job_status(job_id: int, tracer: Tracer, logger: Logger) -> JobStat
         with DBQueryTimer("select"):
             async with app.async_pool.connection() as conn:
                 cur = conn.cursor(row_factory=dict_row)
-                await cur.execute("SELECT (id, status, datetime) FROM jobs WHERE id = %s", (job_id,))
+                await cur.execute("SELECT id, status, datetime, pages_done, pages_total FROM jobs WHERE id = %s", (job_id,))
                 res = await cur.fetchone()
     if res is None:
         logger.info(f"Job {job_id} was not found in the database")
@@ -180,6 +500,26 @@ async def get_job_status(job_id: int, tracer: Tracer, logger: Logger) -> JobStat
     return JobStatus(**res)
 
 
+@app.get("/jobs/events")
+async def job_events() -> StreamingResponse:
+    """
+    Stream changes of jobs as server-sent events, every event carries a JobStatus object.
+
+    A comment is sent when nothing changed for a while, so that idle connections are kept open by proxies.
+    """
+    async def generate():
+        async with app.job_events.subscribe() as queue:
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), 15)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"data: {JobStatus.model_validate(event).model_dump_json()}\n\n"
+
+    return StreamingResponse(generate(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
 @app.post('/jobs/archive/{job_id}')
 async def archive_job(job_id: int, tracer: Tracer, logger: Logger):
     """
@@ -207,104 +547,285 @@ async def parse_pdf(file: UploadFile, tracer: Tracer) -> JobStatus:
     :return: A JobStatus object representing the newly created job.
     :raises HTTPException: If AI workers are not enabled.
     """
+    with tracer.start_as_current_span("spool_upload"):
+        # Starlette keeps large uploads in a temporary file, copying it does not load the document into memory
+        path, sha256, size = await asyncio.to_thread(spool_upload, file.file, settings.spool_dir, ".pdf")
     job_timing = datetime.datetime.now(datetime.UTC)
     with tracer.start_as_current_span("insert_job"):
-        with DBQueryTimer("select"):
+        with DBQueryTimer("insert"):
             async with app.async_pool.connection() as conn:
                 cur = conn.cursor(row_factory=dict_row)
-                await cur.execute("INSERT INTO jobs(status, datetime) VALUES ('pnd', %s) RETURNING id", (job_timing,))
+                await cur.execute(
+                    "INSERT INTO resources(path, sha256, size) VALUES (%s, %s, %s) RETURNING id",
+                    (path, sha256, size),
+                )
+                resource_id = (await cur.fetchone())["id"]
+                await cur.execute(
+                    "INSERT INTO jobs(status, datetime, resource_id) VALUES (%s, %s, %s) RETURNING id",
+                    ("pnd", job_timing, resource_id),
+                )
                 job_id = (await cur.fetchone())["id"]
                 await conn.commit()
     with tracer.start_as_current_span("send_rabbitmq_message"):
-        connection, channel = rabbit_connection()
-        channel.queue_declare(queue=settings.ai_pdf_queue)
-        channel.basic_publish(
-            exchange="",
-            routing_key=settings.ai_pdf_queue,
-            properties=pika.BasicProperties(
-                correlation_id=str(job_id),
-            ),
-            body=await file.read(),
-        )
-
-    connection.close()
+        # The worker reuses the results of an identical earlier upload imported by the same pipeline
+        message = json.dumps({"resource_id": resource_id, "path": path, "sha256": sha256})
+        await app.publisher.publish(settings.ai_pdf_queue, message.encode("utf-8"), correlation_id=str(job_id))
     return JobStatus(id=job_id, status="pnd", datetime=job_timing)
 
 
 @app.post("/parse_screenshot")
 @require(settings.ai_worker_enabled, "This endpoint requires AI workers to be enabled.")
-def parse_screenshot(file: UploadFile, tracer: Tracer) -> str:
+async def parse_screenshot(file: UploadFile, tracer: Tracer) -> str:
     """
     Parse a screenshot file and return latex representation.
 
     :return: LaTeX string representing the formula on the screenshot.
+    :raises HTTPException: If the file is not an image (422 status code).
+    :raises HTTPException: If the worker fails to recognize the formula (500 status code).
+    :raises HTTPException: If the worker does not answer within the configured timeout (504 status code).
     """
-    content = file.file.read()
-    connection, channel = rabbit_connection()
-    channel.queue_declare(queue=settings.ai_latex_ocr_queue)
-    queue_id = uuid.uuid4().hex
-    with tracer.start_as_current_span("call_worker"):
-        channel.queue_declare(
-            queue=queue_id,
-            exclusive=True,
-            auto_delete=True,
-        )
-        channel.basic_publish(
-            exchange="",
-            routing_key=settings.ai_latex_ocr_queue,
-            body=content,
-            properties=pika.BasicProperties(
-                reply_to=queue_id,
-            )
+    content = await file.read()
+    with tracer.start_as_current_span("call_worker") as span:
+        try:
+            reply = await app.publisher.call(settings.ai_latex_ocr_queue, content, settings.ai_latex_ocr_timeout)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=504, detail="Formula recognition timed out")
+        # Results of identical screenshots are reused by the workers for as long as they run this model
+        span.set_attribute("ocr.model", str(reply.headers.get("model", "")))
+    error = reply.headers.get("error")
+    if error == "unreadable":
+        raise HTTPException(status_code=422, detail="Screenshot is not a readable image")
+    if error is not None:
+        raise HTTPException(status_code=500, detail="Formula recognition failed")
+    return reply.body.decode("utf-8")
+
+
+def index_loading() -> HTTPException:
+    """
+    Error of comparisons made while the comparison engine loads its canonical index, see `replica`.
+    """
+    return HTTPException(status_code=503, detail="Comparison index is loading", headers={"Retry-After": "10"})
+
+
+async def top_similar(queries: list[list[str]], mode: Literal["exact", "approximate"], k: int) -> list[list[Similarity]]:
+    """
+    Score indexed formulas against canonical query arrays, see `/compare`.
+
+    :return: Results of every query, empty queries get no results.
+    :raises HTTPException: If the comparison takes longer than the configured timeout (504 status code),
+        or the comparison index is being loaded (503 status code).
+    """
+    if not any(queries):
+        return [[] for _ in queries]
+    # Every engine process searches its shard of formula ids in its own replica of the canonical index
+    try:
+        parts = await app.engine.shards(
+            top_percent_shard, app.formula_index.version, queries, k, mode == "approximate"
         )
-        response: str | None = None
-        def consume(ch: pika.adapters.blocking_connection.BlockingChannel, method, properties, body):
-            nonlocal response
-            response = body.decode("utf-8")
-            ch.stop_consuming()
-        channel.basic_consume(on_message_callback=consume, queue=queue_id, auto_ack=True)
-        channel.start_consuming()
-    return response
+    except ComparisonTimeout:
+        raise HTTPException(status_code=504, detail="Comparison timed out")
+    except ReplicaNotReady:
+        raise index_loading()
+    formulas = app.formula_index.formulas
+    # Replicas may already follow a newer catalogue version, formulas unknown to the API index are skipped
+    return [
+        [
+            Similarity(id=formula_id, formula=formulas[formula_id]["latex"], percent=score)
+            for score, formula_id in heapq.nlargest(k, (score for part in parts for score in part[index]))
+            if formula_id in formulas
+        ]
+        for index in range(len(queries))
+    ]
 
 
 @app.post("/compare")
-async def compare(formula: Formula):
+async def compare(
+        formula: Formula,
+        top_k: Annotated[int | None, Query(ge=1)] = None,
+        mode: Literal["exact", "approximate"] = "exact",
+) -> CompareResponse:
+    """
+    Find formulas most similar to the given one by their canonical arrays.
+
+    In `exact` mode formulas sharing a canonical token with the query are scored, best candidates first,
+    until no remaining candidate can enter the top `top_k`. In `approximate` mode only formulas
+    colliding with the query in the MinHash LSH table are scored.
+
+    :return: Used mode and up to `top_k` formulas with their similarity percentage, most similar first.
+    :raises HTTPException: If the query can not be parsed (422 status code)
+        or the comparison takes longer than the configured timeout (504 status code),
+        or the comparison index is being loaded (503 status code).
+    """
     tracer = trace.get_tracer(__name__)
-    with tracer.start_as_current_span("select_formulas"):
-        with DBQueryTimer("select"):
-            async with app.async_pool.connection() as conn:
-                cur = conn.cursor(row_factory=dict_row)
-                await cur.execute("SELECT latex FROM formulas")
-                all = [row["latex"] for row in await cur.fetchall()]
-    result = [
-        {"formula": db_formula, "percent": percent(formula.latex, db_formula)}
-        for db_formula in all
-    ]
-    return result
+    k = top_k or settings.compare_top_k
+    with tracer.start_as_current_span("refresh_index"):
+        await app.formula_index.refresh(app.async_pool)
+
+    async def compute() -> CompareResponse:
+        with tracer.start_as_current_span("canonicalize_query"):
+            try:
+                query = await app.canonical_cache.get(formula.latex)
+            except ComparisonTimeout:
+                raise HTTPException(status_code=504, detail="Comparison timed out")
+        if not query:
+            raise HTTPException(status_code=422, detail="Formula could not be parsed")
+        with tracer.start_as_current_span("score_formulas"):
+            return CompareResponse(mode=mode, results=(await top_similar([query], mode, k))[0])
+
+    key = ("compare", normalize_latex(formula.latex), mode, k, app.formula_index.version)
+    return await app.result_cache.get(key, compute)
+
+
+@app.post("/compare/batch")
+async def compare_batch(
+        formulas: list[Formula],
+        tracer: Tracer,
+        top_k: Annotated[int | None, Query(ge=1)] = None,
+        mode: Literal["exact", "approximate"] = "exact",
+) -> list[CompareResponse]:
+    """
+    Find formulas most similar to each of the given ones, see `/compare`.
+
+    All queries are canonicalized at once and scored together by the processes of the comparison engine,
+    against the same state of the catalogue.
+
+    :return: Results of every query in the order they were sent, queries that can not be parsed get no results.
+    :raises HTTPException: If the comparison takes longer than the configured timeout (504 status code),
+        or the comparison index is being loaded (503 status code).
+    """
+    k = top_k or settings.compare_top_k
+    with tracer.start_as_current_span("refresh_index"):
+        await app.formula_index.refresh(app.async_pool)
+    with tracer.start_as_current_span("canonicalize_queries"):
+        try:
+            queries = await app.engine.map(canonicalize_many, [formula.latex for formula in formulas])
+        except ComparisonTimeout:
+            raise HTTPException(status_code=504, detail="Comparison timed out")
+    with tracer.start_as_current_span("score_formulas"):
+        results = await top_similar(queries, mode, k)
+    return [CompareResponse(mode=mode, results=result) for result in results]
 
 
 @app.post("/compare_indexes")
-async def compare_indexes(formula: Formula, tracer: Tracer):
-    with tracer.start_as_current_span("select_formulas"):
-        with DBQueryTimer("select"):
-            async with app.async_pool.connection() as conn:
-                cur = conn.cursor(row_factory=dict_row)
-                await cur.execute("SELECT id, name, latex, source, description FROM formulas")
-                all = await cur.fetchall()
-    result = sorted([
-        {"formula": db_formula, "indexes": find_indexes(db_formula['latex'], formula.latex)}
-        for db_formula in all
-    ], key=lambda x:sum([i[1]-i[0] if i != None else 0 for i in x['indexes']]) if x['indexes'] else 0, reverse=True)
-    return result
+async def compare_indexes(formula: Formula, tracer: Tracer, top_k: Annotated[int | None, Query(ge=1)] = None):
+    """
+    Find formulas having common subexpressions with the given one.
+
+    Only formulas sharing an abstracted token trigram with the query are compared.
+
+    :return: Up to `top_k` formulas with character ranges of common subexpressions, largest coverage first.
+    :raises HTTPException: If the comparison takes longer than the configured timeout (504 status code).
+    """
+    k = top_k or settings.compare_top_k
+    with tracer.start_as_current_span("refresh_index"):
+        await app.formula_index.refresh(app.async_pool)
+
+    async def compute() -> list[dict]:
+        with tracer.start_as_current_span("compare_formulas"):
+            query = prepare_formula(formula.latex)
+            candidates = [
+                (formula_id, app.formula_index.prepared[formula_id])
+                for formula_id in app.formula_index.abstract_candidates(query)
+            ]
+            try:
+                indexes = await app.engine.map(find_indexes_many, candidates, query)
+            except ComparisonTimeout:
+                raise HTTPException(status_code=504, detail="Comparison timed out")
+            result = sorted([
+                {"formula": app.formula_index.formulas[formula_id], "indexes": formula_indexes}
+                for formula_id, formula_indexes in indexes
+            ], key=lambda x:sum([i[1]-i[0] if i != None else 0 for i in x['indexes']]) if x['indexes'] else 0, reverse=True)
+        return result[:k]
+
+    key = ("compare_indexes", normalize_latex(formula.latex), k, app.formula_index.version)
+    return await app.result_cache.get(key, compute)
+
+
+@app.post("/compare/stream")
+async def compare_stream(formula: Formula) -> StreamingResponse:
+    """
+    Compare a formula with every formula in the database and stream the results as NDJSON.
+
+    Each line holds `id`, `formula` and `percent`, in order of formula ids. Results are scored
+    batch by batch while they are fetched, so the response does not grow in memory.
+
+    :raises HTTPException: If the query can not be parsed (422 status code)
+        or canonicalizing it takes longer than the configured timeout (504 status code).
+    """
+    try:
+        query = await app.canonical_cache.get(formula.latex)
+    except ComparisonTimeout:
+        raise HTTPException(status_code=504, detail="Comparison timed out")
+    if not query:
+        raise HTTPException(status_code=422, detail="Formula could not be parsed")
+    # Makes sure every stored formula has its canonical array
+    await app.formula_index.refresh(app.async_pool)
+
+    async def lines():
+        async for rows in stream_rows("SELECT id, latex, canonical FROM formulas ORDER BY id"):
+            latex = {row["id"]: row["latex"] for row in rows}
+            try:
+                scores = await app.engine.map(percent_many, [(row["id"], row["canonical"]) for row in rows], query)
+            except ComparisonTimeout:
+                yield json.dumps({"error": "Comparison timed out"}) + "\n"
+                return
+            yield "".join(
+                Similarity(id=formula_id, formula=latex[formula_id], percent=score).model_dump_json() + "\n"
+                for formula_id, score in scores
+            )
+    return ndjson_response(lines())
+
+
+@app.post("/compare_indexes/stream")
+async def compare_indexes_stream(formula: Formula) -> StreamingResponse:
+    """
+    Find common subexpressions of a formula and every formula in the database and stream the results as NDJSON.
+
+    Each line holds `formula` and `indexes` like `/compare_indexes`, in order of formula ids,
+    including formulas without common subexpressions.
+    """
+    async def lines():
+        async for rows in stream_rows("SELECT id, name, latex, source, description FROM formulas ORDER BY id"):
+            formulas = {row["id"]: row for row in rows}
+            try:
+                indexes = await app.engine.map(
+                    find_indexes_latex_many, [(row["id"], row["latex"] or "") for row in rows], formula.latex
+                )
+            except ComparisonTimeout:
+                yield json.dumps({"error": "Comparison timed out"}) + "\n"
+                return
+            yield "".join(
+                json.dumps({"formula": formulas[formula_id], "indexes": formula_indexes}) + "\n"
+                for formula_id, formula_indexes in indexes
+            )
+    return ndjson_response(lines())
 
 
 @app.post("/message")
 @require(settings.ai_worker_enabled, "This endpoint requires AI workers to be enabled.")
 async def messages(messages: list[ollama.Message], tracer: Tracer):
+    """
+    Answer a chat with the assistant.
+
+    :return: Content of the assistant reply.
+    """
     with tracer.start_as_current_span("ollama_call"):
-        app.client: ollama.Client
-        response: ollama.ChatResponse = app.client.chat(model=settings.ollama_model, messages=messages)
+        async with app.llm_semaphore:
+            response: ollama.ChatResponse = await app.client.chat(model=settings.ollama_model, messages=messages)
         return response.message.content
-        
 
 
+@app.post("/message/stream")
+@require(settings.ai_worker_enabled, "This endpoint requires AI workers to be enabled.")
+async def messages_stream(messages: list[ollama.Message]) -> StreamingResponse:
+    """
+    Answer a chat with the assistant, sending the reply as server-sent events while it is generated.
+
+    Every event carries a JSON object with the next `content` chunk, the last one has `done` set.
+    """
+    async def generate():
+        async with app.llm_semaphore:
+            async for chunk in await app.client.chat(model=settings.ollama_model, messages=messages, stream=True):
+                yield f"data: {json.dumps({'content': chunk.message.content, 'done': chunk.done})}\n\n"
+
+    return StreamingResponse(generate(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
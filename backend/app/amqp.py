@@ -0,0 +1,122 @@
+import asyncio
+import time
+import uuid
+
+import aio_pika
+from aio_pika.abc import AbstractChannel, AbstractIncomingMessage, AbstractQueue, AbstractRobustConnection
+from aio_pika.pool import Pool
+
+from .logging_config import (
+    get_logger,
+    log_rabbitmq_message,
+    AMQP_CHANNELS,
+    AMQP_PENDING_CALLS,
+    AMQP_CONFIRM_LATENCY,
+    AMQP_RECONNECTS,
+)
+
+
+class Publisher:
+    """
+    Long-lived AMQP publisher.
+
+    Keeps one robust connection that reconnects automatically and a pool of channels with
+    publisher confirms, so publishing a message waits for the broker instead of opening a connection.
+    Queues are declared once per process.
+
+    Request-reply calls share a single exclusive reply queue per process, replies are routed
+    to waiting callers by their correlation id.
+    """
+
+    def __init__(self, url: str, pool_size: int = 8):
+        self.url = url
+        self.pool_size = pool_size
+        self._connection: AbstractRobustConnection | None = None
+        self._channels: Pool[AbstractChannel] | None = None
+        self._declared: set[str] = set()
+        self._reply_queue: AbstractQueue | None = None
+        self._calls: dict[str, asyncio.Future] = {}
+
+    async def start(self):
+        self._connection = await aio_pika.connect_robust(self.url)
+        self._connection.reconnect_callbacks.add(self._on_reconnect)
+        self._channels = Pool(self._open_channel, max_size=self.pool_size)
+        reply_channel = await self._connection.channel()
+        # Named by the client, RobustQueue restores a queue under its stored name after a reconnect and
+        # the broker refuses declaring reserved `amq.gen-` names of server-named queues
+        self._reply_queue = await reply_channel.declare_queue(
+            f"reply.{uuid.uuid4().hex}", exclusive=True, auto_delete=True
+        )
+        await self._reply_queue.consume(self._on_reply, no_ack=True)
+
+    async def close(self):
+        for future in self._calls.values():
+            future.cancel()
+        if self._channels is not None:
+            await self._channels.close()
+        if self._connection is not None:
+            await self._connection.close()
+        AMQP_CHANNELS.set(0)
+
+    def _on_reconnect(self, *_):
+        AMQP_RECONNECTS.inc()
+        get_logger(__name__).warning("AMQP connection recovered")
+
+    async def _open_channel(self) -> AbstractChannel:
+        channel = await self._connection.channel(publisher_confirms=True)
+        AMQP_CHANNELS.inc()
+        channel.close_callbacks.add(lambda *_: AMQP_CHANNELS.dec())
+        return channel
+
+    def _on_reply(self, message: AbstractIncomingMessage):
+        future = self._calls.get(message.correlation_id)
+        if future is None or future.done():
+            get_logger(__name__).info(f"Dropping reply to unknown or expired call {message.correlation_id}")
+            return
+        future.set_result(message)
+
+    async def declare(self, queue: str):
+        """
+        Declare a queue unless it was already declared by this process.
+        """
+        if queue in self._declared:
+            return
+        async with self._channels.acquire() as channel:
+            # Workers reject failed messages into `<queue>.dead`, the arguments have to match their declaration
+            await channel.declare_queue(f"{queue}.dead")
+            await channel.declare_queue(queue, arguments={
+                "x-dead-letter-exchange": "",
+                "x-dead-letter-routing-key": f"{queue}.dead",
+            })
+        self._declared.add(queue)
+
+    async def publish(self, queue: str, body: bytes, **properties):
+        """
+        Publish a message to a queue through the default exchange and wait for the broker confirmation.
+
+        :param properties: Message properties, e.g. `correlation_id` or `reply_to`
+        """
+        await self.declare(queue)
+        async with self._channels.acquire() as channel:
+            start = time.perf_counter()
+            await channel.default_exchange.publish(aio_pika.Message(body, **properties), routing_key=queue)
+            AMQP_CONFIRM_LATENCY.labels(queue).observe(time.perf_counter() - start)
+        log_rabbitmq_message(queue, "published")
+
+    async def call(self, queue: str, body: bytes, timeout: float) -> AbstractIncomingMessage:
+        """
+        Publish a request to a queue and wait for the reply of a worker.
+
+        :return: Reply of the worker
+        :raises asyncio.TimeoutError: If no reply arrives within `timeout` seconds.
+        """
+        correlation_id = uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        self._calls[correlation_id] = future
+        AMQP_PENDING_CALLS.inc()
+        try:
+            await self.publish(queue, body, correlation_id=correlation_id, reply_to=self._reply_queue.name)
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            del self._calls[correlation_id]
+            AMQP_PENDING_CALLS.dec()
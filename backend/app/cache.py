@@ -0,0 +1,169 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+from psycopg_pool import AsyncConnectionPool
+
+from .canonical import canonicalize
+from .engine import ComparisonEngine
+from .logging_config import (
+    DBQueryTimer,
+    CANONICAL_CACHE_HITS,
+    CANONICAL_CACHE_MISSES,
+    CANONICAL_CACHE_EVICTIONS,
+    RESPONSE_CACHE_HITS,
+    RESPONSE_CACHE_MISSES,
+)
+
+
+def normalize_latex(latex: str) -> str:
+    """
+    Normalize a LaTeX string for use as a cache key.
+
+    Whitespace runs are collapsed rather than removed, since a space may terminate a command name.
+    """
+    return " ".join(latex.split())
+
+
+async def coalesce(
+    pending: dict[Hashable, asyncio.Future], key: Hashable, compute: Callable[[Hashable], Awaitable[Any]]
+) -> Any:
+    """
+    Compute a value once for all concurrent callers asking for the same key.
+
+    The first caller runs `compute(key)`, later callers wait for its result while it is pending.
+    Waiting callers being cancelled does not cancel the computation.
+
+    :param pending: Futures of the computations in progress, owned by the cache
+    :param compute: Function computing the value, exceptions it raises are passed on to all callers
+    """
+    if key in pending:
+        return await asyncio.shield(pending[key])
+    future = asyncio.get_running_loop().create_future()
+    pending[key] = future
+    try:
+        result = await compute(key)
+        future.set_result(result)
+        return result
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        # Mark the exception as retrieved when nobody else waits for it
+        future.exception()
+        raise
+    finally:
+        del pending[key]
+
+
+class CanonicalCache:
+    """
+    Bounded LRU cache of canonical arrays keyed by normalized LaTeX.
+
+    Misses are computed in the comparison engine, concurrent misses of the same key are computed once.
+    With `shared` enabled, the `canonical_cache` table is consulted before computing and filled
+    after it, so that several backend processes reuse each other's results.
+    """
+
+    def __init__(self, engine: ComparisonEngine, pool: AsyncConnectionPool, size: int = 1024, shared: bool = False):
+        self.engine = engine
+        self.pool = pool
+        self.size = size
+        self.shared = shared
+        self._entries: OrderedDict[str, list[str]] = OrderedDict()
+        self._pending: dict[str, asyncio.Future] = {}
+
+    def _put(self, key: str, canonical: list[str]):
+        self._entries[key] = canonical
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+            CANONICAL_CACHE_EVICTIONS.inc()
+
+    async def get(self, latex: str) -> list[str]:
+        """
+        Get the canonical array of a formula, see `canonicalize`.
+
+        :return: Canonical array, empty if the formula can not be parsed
+        :raises ComparisonTimeout: If computing the canonical array takes too long.
+        """
+        key = normalize_latex(latex)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            CANONICAL_CACHE_HITS.labels("memory").inc()
+            return self._entries[key]
+        if key in self._pending:
+            CANONICAL_CACHE_HITS.labels("pending").inc()
+        return await coalesce(self._pending, key, self._fill)
+
+    async def _fill(self, key: str) -> list[str]:
+        canonical = await self._load(key)
+        self._put(key, canonical)
+        return canonical
+
+    async def _load(self, key: str) -> list[str]:
+        if self.shared:
+            with DBQueryTimer("select"):
+                async with self.pool.connection() as conn:
+                    cur = await conn.execute("SELECT canonical FROM canonical_cache WHERE latex = %s", (key,))
+                    row = await cur.fetchone()
+            if row is not None:
+                CANONICAL_CACHE_HITS.labels("shared").inc()
+                return row[0]
+        CANONICAL_CACHE_MISSES.inc()
+        canonical = await self.engine.run(canonicalize, key)
+        if self.shared:
+            with DBQueryTimer("insert"):
+                async with self.pool.connection() as conn:
+                    await conn.execute(
+                        "INSERT INTO canonical_cache(latex, canonical) VALUES (%s, %s) ON CONFLICT DO NOTHING",
+                        (key, canonical),
+                    )
+                    await conn.commit()
+        return canonical
+
+
+class ResultCache:
+    """
+    Bounded LRU cache of computed endpoint results with a time to live.
+
+    Keys are expected to contain the catalogue version, so that results computed against an older
+    catalogue are never returned and simply age out. Concurrent misses of the same key are computed once.
+    """
+
+    def __init__(self, size: int = 1024, ttl: float = 300):
+        self.size = size
+        self.ttl = ttl
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._pending: dict[Hashable, asyncio.Future] = {}
+
+    async def get(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Get a cached result or compute and cache it.
+
+        :param compute: Function computing the result, exceptions it raises are passed on and not cached
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires, result = entry
+            if expires > time.monotonic():
+                self._entries.move_to_end(key)
+                RESPONSE_CACHE_HITS.labels("memory").inc()
+                return result
+            del self._entries[key]
+        if key in self._pending:
+            RESPONSE_CACHE_HITS.labels("pending").inc()
+        else:
+            RESPONSE_CACHE_MISSES.inc()
+
+        async def fill(key: Hashable) -> Any:
+            result = await compute()
+            self._entries[key] = (time.monotonic() + self.ttl, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+            return result
+
+        return await coalesce(self._pending, key, fill)
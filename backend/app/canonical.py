@@ -0,0 +1,142 @@
+import asyncio
+
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+from .compare_functions import canonical_array
+from .engine import ComparisonEngine, ComparisonTimeout
+from .logging_config import get_logger, DBQueryTimer
+
+
+def canonicalize(latex: str | None) -> list[str]:
+    """
+    Compute the canonical array of a stored formula.
+
+    Formulas that can not be parsed get an empty array, so they are stored as "known unparseable"
+    instead of being retried on every request.
+
+    :param latex: LaTeX expression
+    :return: Canonical array or an empty list
+    """
+    try:
+        return canonical_array(latex)
+    except Exception:
+        return []
+
+
+def canonicalize_many(latexes: list[str | None]) -> list[list[str]]:
+    """
+    Compute canonical arrays of several formulas, see `canonicalize`.
+    """
+    return [canonicalize(latex) for latex in latexes]
+
+
+async def compute_canonical(engine: ComparisonEngine, latex: str | None) -> list[str]:
+    """
+    Compute the canonical array of a formula in the comparison engine.
+
+    Formulas that time out are treated as unparseable, so they are not retried forever.
+    """
+    try:
+        return await engine.run(canonicalize, latex)
+    except ComparisonTimeout:
+        return []
+
+
+async def store_missing(pool: AsyncConnectionPool, engine: ComparisonEngine, rows: list[dict], batch_size: int = 100) -> None:
+    """
+    Compute and persist canonical arrays for rows that do not have one yet.
+
+    Covers rows created before the column existed, rows inserted by the worker and rows whose
+    LaTeX was changed (the database trigger resets `canonical` to NULL in that case).
+    Rows are updated in place and committed in batches, so progress survives restarts.
+
+    :param rows: Rows with `id`, `latex` and `canonical` keys
+    """
+    logger = get_logger(__name__)
+    missing = [row for row in rows if row["canonical"] is None]
+    for start in range(0, len(missing), batch_size):
+        batch = missing[start:start + batch_size]
+        try:
+            canonicals = await engine.map(canonicalize_many, [row["latex"] for row in batch])
+        except ComparisonTimeout:
+            # Find the formulas responsible for the timeout one by one
+            canonicals = [await compute_canonical(engine, row["latex"]) for row in batch]
+        for row, canonical in zip(batch, canonicals):
+            row["canonical"] = canonical
+        with DBQueryTimer("update"):
+            async with pool.connection() as conn:
+                cur = conn.cursor()
+                # The LaTeX check skips rows that were edited while their canonical form was computed
+                await cur.executemany(
+                    "UPDATE formulas SET canonical = %s WHERE id = %s AND latex IS NOT DISTINCT FROM %s",
+                    [(row["canonical"], row["id"], row["latex"]) for row in batch],
+                )
+                await conn.commit()
+    if missing:
+        logger.info(f"Computed canonical forms for {len(missing)} formulas")
+
+
+async def backfill(pool: AsyncConnectionPool, engine: ComparisonEngine, batch_size: int = 100) -> int:
+    """
+    Compute and persist canonical arrays of all stored formulas that do not have one yet, see `store_missing`.
+
+    :return: Amount of formulas processed
+    """
+    total, after = 0, -1
+    while True:
+        with DBQueryTimer("select"):
+            async with pool.connection() as conn:
+                cur = conn.cursor(row_factory=dict_row)
+                # Rows are walked by id, rows edited while their canonical form was computed are left for the next run
+                await cur.execute(
+                    "SELECT id, latex, canonical FROM formulas WHERE canonical IS NULL AND id > %s ORDER BY id LIMIT %s",
+                    (after, batch_size),
+                )
+                rows = await cur.fetchall()
+        if not rows:
+            return total
+        await store_missing(pool, engine, rows, batch_size)
+        total += len(rows)
+        after = rows[-1]["id"]
+
+
+class Backfill:
+    """
+    Fills missing canonical arrays in the background, so that comparisons never wait for it and
+    use the index as it currently stands.
+
+    Formulas lack a canonical array when they were imported by the worker, edited, or their
+    canonicalization timed out on upload. The backfill uses its own comparison engine, so that
+    formulas timing out do not restart the processes holding the canonical index.
+    """
+
+    def __init__(self, pool: AsyncConnectionPool, engine: ComparisonEngine, batch_size: int = 100):
+        self.pool = pool
+        self.engine = engine
+        self.batch_size = batch_size
+        self._task: asyncio.Task | None = None
+        self._again = False
+
+    def start(self):
+        """
+        Start a backfill, or run another one after the running one, which may have passed changed rows already.
+        """
+        self._again = True
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        logger = get_logger(__name__)
+        while self._again:
+            self._again = False
+            try:
+                await backfill(self.pool, self.engine, self.batch_size)
+            except Exception as e:
+                logger.warning(f"Computing missing canonical forms failed: {e}")
+                return
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+        self.engine.close()
@@ -1,8 +1,24 @@
 import sympy
 from sympy import simplify, expand
 from sympy.parsing.latex import parse_latex
+import bisect
 import difflib as df
 import re
+from array import array
+from typing import NamedTuple
+
+# Регулярное выражение для более точного разбиения LaTeX-выражений
+TOKEN_PATTERN = re.compile('(\\[a-zA-Z]+|\d+\.?\d*|[a-zA-Z]+|[(){}^_]|[\+\-\*/=])')
+VARIABLE_PATTERN = re.compile(r'[a-zA-Z]+')
+GREEK_LETTERS = frozenset({
+    '\\alpha', '\\beta', '\\gamma', '\\delta', '\\epsilon', '\\zeta', '\\eta', '\\theta',
+    '\\iota', '\\kappa', '\\lambda', '\\mu', '\\nu', '\\xi', '\\pi', '\\rho', '\\sigma', '\\tau',
+    '\\upsilon', '\\phi', '\\chi', '\\psi', '\\omega', '\\Gamma', '\\Delta', '\\Epsilon',
+    '\\Zeta', '\\Eta', '\\Theta', '\\Iota', '\\Kappa', '\\Lambda', '\\Mu', '\\Nu', '\\Xi',
+    '\\Pi', '\\Rho', '\\Sigma', '\\Tau', '\\Upsilon', '\\Phi', '\\Chi', '\\Psi', '\\Omega'
+})
+# Integer ids of abstracted tokens, shared by all formulas prepared in a process
+TOKEN_IDS: dict[str, int] = {}
 
 
 def latex_to_array(array: list, index: int = 0):
@@ -47,33 +63,51 @@ def indexing_and_stringify(array: list):
             array[i] = str(array[i])
 
 
-def percent(latex1, latex2):
+def canonical_array(latex: str) -> list[str]:
     """
-    Calculate the similarity percentage between two LaTeX expressions.
+    Convert a LaTeX expression into its canonical form: a flattened, variable-indexed token array.
 
-    :param latex1: First LaTeX expression
-    :param latex2: Second LaTeX expression
-    :return: Similarity percentage
+    :param latex: LaTeX expression
+    :return: List of string tokens
+    """
+    array = [expand(simplify(parse_latex(latex)))]
+    latex_to_array(array, 0)
+    indexing_and_stringify(array)
+    return array
+
+
+def percent_arrays(array1: list[str], array2: list[str]):
     """
-    l1 = [expand(simplify(parse_latex(latex1)))]
-    l2 = [expand(simplify(parse_latex(latex2)))]
-    latex_to_array(l1, 0)
-    latex_to_array(l2, 0)
-    indexing_and_stringify(l1)
-    indexing_and_stringify(l2)
+    Calculate the similarity percentage between two canonical arrays.
 
-    s = df.SequenceMatcher(None, l1, l2)
+    :param array1: First canonical array
+    :param array2: Second canonical array
+    :return: Similarity percentage
+    """
+    if not array1 or not array2:
+        return 0.0
+    s = df.SequenceMatcher(None, array1, array2)
     result = s.get_matching_blocks()
     result = result[:(len(result) - 1)]
-    result = [[match.a, match.b, match.size] for match in sorted(result, key=lambda x: x.size, reverse=True)]
     count_match_size = 0
-    for i in result:
-        count_match_size += i[2]
-    result_percentage = count_match_size / max(len(l1), len(l2)) * 100
+    for match in result:
+        count_match_size += match.size
+    result_percentage = count_match_size / max(len(array1), len(array2)) * 100
 
     return result_percentage
 
 
+def percent(latex1, latex2):
+    """
+    Calculate the similarity percentage between two LaTeX expressions.
+
+    :param latex1: First LaTeX expression
+    :param latex2: Second LaTeX expression
+    :return: Similarity percentage
+    """
+    return percent_arrays(canonical_array(latex1), canonical_array(latex2))
+
+
 def split_latex_expression(latex_str: str) -> list[str]:
     """
     Separate input latex expression into a list of separate tokens.
@@ -81,8 +115,7 @@ def split_latex_expression(latex_str: str) -> list[str]:
     :param latex_str: Latex expression string
     :return: list of tokens
     """
-    # Регулярное выражение для более точного разбиения LaTeX-выражений
-    tokens = re.findall('(\\[a-zA-Z]+|\d+\.?\d*|[a-zA-Z]+|[(){}^_]|[\+\-\*/=])', latex_str)
+    tokens = TOKEN_PATTERN.findall(latex_str)
     return tokens
 
 
@@ -107,19 +140,13 @@ def abstract_tokens(tokens):
     :param tokens: List of tokens
     :return: Abstracted tokens, indexed abstracted tokens, and variable mapping
     """
-    greek_letters = {'\\alpha', '\\beta', '\\gamma', '\\delta', '\\epsilon', '\\zeta', '\\eta', '\\theta',
-                     '\\iota', '\\kappa', '\\lambda', '\\mu', '\\nu', '\\xi', '\\pi', '\\rho', '\\sigma', '\\tau',
-                     '\\upsilon', '\\phi', '\\chi', '\\psi', '\\omega', '\\Gamma', '\\Delta', '\\Epsilon',
-                     '\\Zeta', '\\Eta', '\\Theta', '\\Iota', '\\Kappa', '\\Lambda', '\\Mu', '\\Nu', '\\Xi',
-                     '\\Pi', '\\Rho', '\\Sigma', '\\Tau', '\\Upsilon', '\\Phi', '\\Chi', '\\Psi', '\\Omega'
-                     }
     abstracted_indexed = []
     abstracted = []
     var_map = {}
     var_count = 1
 
     for token in tokens:
-        if re.match(r'^[a-zA-Z]+$', token) or token in greek_letters:
+        if VARIABLE_PATTERN.fullmatch(token) or token in GREEK_LETTERS:
             if token not in var_map:
                 var_map[token] = f'VAR{var_count}'
                 var_count += 1
@@ -190,9 +217,45 @@ def compare_two_blocks(subtoken1, subtoken2, block, result_block=None):
     return result_block
 
 
+def common_suffix_runs(sequence1, sequence2):
+    """
+    Enumerate diagonal runs of equal elements the way a backward scan of the longest common suffix table does.
+
+    Visits cells from the bottom-right corner of the `(n+1)x(m+1)` table of common suffix lengths,
+    jumping straight to cells with equal elements instead of filling the table. After a run of
+    length `size` ending at `(i, j)` the scan moves `size - 1` rows up and left past the run.
+    Uses O(n+m) memory.
+
+    :param sequence1: First sequence of hashable elements
+    :param sequence2: Second sequence of hashable elements
+    :return: Generator of (i, j, size) runs ending right before positions i and j
+    """
+    positions = {}
+    for j, element in enumerate(sequence2, 1):
+        positions.setdefault(element, []).append(j)
+    i = len(sequence1)
+    while i > 0:
+        j = len(sequence2)
+        while j > 0:
+            # Closest column at or left of j holding the element of row i
+            columns = positions.get(sequence1[i - 1])
+            k = bisect.bisect_right(columns, j) - 1 if columns else -1
+            if k < 0:
+                break
+            j = columns[k]
+            size = 1
+            while size < i and size < j and sequence1[i - 1 - size] == sequence2[j - 1 - size]:
+                size += 1
+            yield i, j, size
+            i -= size - 1
+            j -= size
+            j -= 1
+        i -= 1
+
+
 def find_common_blocks(tokens1, abstracted_tokens1, tokens2, abstracted_tokens2):
     """
-    Find common blocks between two sets of tokens using dynamic programming.
+    Find common blocks between two sets of tokens.
 
     :param tokens1: First set of tokens
     :param abstracted_tokens1: Abstracted first set of tokens
@@ -200,43 +263,97 @@ def find_common_blocks(tokens1, abstracted_tokens1, tokens2, abstracted_tokens2)
     :param abstracted_tokens2: Abstracted second set of tokens
     :return: List of common blocks
     """
-    n, m = len(abstracted_tokens1), len(abstracted_tokens2)
-    dp = [[0] * (m + 1) for _ in range(n + 1)]
-
-    # Заполняем DP таблицу  // Diabl: wtf is this?  // leshenya: dynamic programming table
-    for i in range(1, n + 1):
-        for j in range(1, m + 1):
-            if abstracted_tokens1[i - 1] == abstracted_tokens2[j - 1]:
-                dp[i][j] = dp[i - 1][j - 1] + 1
-
     # Найти все уникальные общие блоки
     result = []
     seen_blocks = set()
-    i = n
-    while i > 0:
-        j = m
-        while j > 0:
-            if dp[i][j] > 0:
-                size = dp[i][j]
-                if size > 2:
-                    start1 = i - size
-                    start2 = j - size
-                    block = (start1, start2, size)
-                    sub_blocks = compare_two_blocks(tokens1[start1:start1 + size], tokens2[start2:start2 + size], block)
-
-                    # Добавляем только если блок еще не покрыт более длинным
-                    for sub_block in sub_blocks:
-                        if sub_block not in seen_blocks:
-                            result.append(sub_block)
-                            seen_blocks.add(sub_block)
-                i -= size - 1
-                j -= size
-            j -= 1
-        i -= 1
+    for i, j, size in common_suffix_runs(abstracted_tokens1, abstracted_tokens2):
+        if size > 2:
+            start1 = i - size
+            start2 = j - size
+            block = (start1, start2, size)
+            sub_blocks = compare_two_blocks(tokens1[start1:start1 + size], tokens2[start2:start2 + size], block)
+
+            # Добавляем только если блок еще не покрыт более длинным
+            for sub_block in sub_blocks:
+                if sub_block not in seen_blocks:
+                    result.append(sub_block)
+                    seen_blocks.add(sub_block)
     result.sort(key=lambda x: x[2], reverse=True)
     return result
 
 
+class PreparedFormula(NamedTuple):
+    """Tokenized formula ready for `find_indexes_prepared`."""
+    # Interned ids of abstracted tokens
+    abstracted: array
+    # Abstracted tokens with indexed variables
+    abstracted_indexed: list[str]
+    # Character offset of every token boundary in the source LaTeX
+    offsets: array
+
+
+def tokenize_formula(latex: str) -> tuple[list[str], list[str], array]:
+    """
+    Tokenize and abstract a LaTeX formula without interning its tokens, see `intern_formula`.
+
+    Token ids are only valid in the process that interned them, so formulas tokenized in other
+    processes must be interned in the process comparing them.
+
+    :param latex: LaTeX formula
+    :return: Abstracted tokens, indexed abstracted tokens and token boundary offsets
+    """
+    tokens = split_latex_expression(latex)
+    abstracted, abstracted_indexed, _ = abstract_tokens(tokens)
+    offsets = array('i', [0])
+    for token in tokens:
+        offsets.append(offsets[-1] + len(token) + token.count('\\'))
+    return abstracted, abstracted_indexed, offsets
+
+
+def intern_formula(abstracted: list[str], abstracted_indexed: list[str], offsets: array) -> PreparedFormula:
+    """
+    Replace abstracted tokens of a tokenized formula with ids of the current process, see `tokenize_formula`.
+
+    :return: Prepared formula
+    """
+    return PreparedFormula(
+        array('i', [TOKEN_IDS.setdefault(token, len(TOKEN_IDS)) for token in abstracted]),
+        abstracted_indexed,
+        offsets,
+    )
+
+
+def prepare_formula(latex: str) -> PreparedFormula:
+    """
+    Tokenize and abstract a LaTeX formula once, so it can be compared many times.
+
+    :param latex: LaTeX formula
+    :return: Prepared formula
+    """
+    return intern_formula(*tokenize_formula(latex))
+
+
+def find_indexes_prepared(formula1: PreparedFormula, formula2: PreparedFormula) -> list[(int, int)]:
+    """
+    Find common subexpression indexes between two prepared formulas, see `find_indexes`.
+
+    Both formulas must be prepared in the same process, so that their token ids agree.
+
+    :param formula1: First prepared formula
+    :param formula2: Second prepared formula
+    :return: List of tuples containing start and end indices of common subexpressions in the first formula
+    """
+    common_blocks = find_common_blocks(
+        formula1.abstracted_indexed, formula1.abstracted,
+        formula2.abstracted_indexed, formula2.abstracted,
+    )
+    result = [
+        (formula1.offsets[start1], formula1.offsets[start1 + size])
+        for start1, start2, size in common_blocks
+    ]
+    return sorted(result, key=lambda x: x[0])
+
+
 def find_indexes(formula1: str, formula2: str) -> list[(int, int)]:
     """
     Find common subexpression indexes between two LaTeX formulas.
@@ -245,16 +362,4 @@ def find_indexes(formula1: str, formula2: str) -> list[(int, int)]:
     :param formula2: Second LaTeX formula
     :return: List of tuples containing start and end indices of common subexpressions
     """
-    tokens1 = split_latex_expression(formula1)
-    tokens2 = split_latex_expression(formula2)
-    abstracted1, abstracted_indexed1, var_map1 = abstract_tokens(tokens1)
-    abstracted2, abstracted_indexed2, var_map2 = abstract_tokens(tokens2)
-    common_blocks = find_common_blocks(abstracted_indexed1, abstracted1, abstracted_indexed2, abstracted2)
-    result = []
-    for start1, start2, size in common_blocks:
-        pre_string = ''.join(tokens1[:start1])
-        start_index = len(pre_string) + pre_string.count('\\')
-        full_string = ''.join(tokens1[:start1 + size])
-        end_index = len(full_string) + full_string.count('\\')
-        result.append((start_index, end_index))
-    return sorted(result, key=lambda x: x[0])
+    return find_indexes_prepared(prepare_formula(formula1), prepare_formula(formula2))
@@ -15,13 +15,54 @@ class Settings(BaseSettings):
     postgres_dsn: PostgresDsn = Field()
     # Amount of connections single application can have to the database
     postgres_pool_size: int = 64
+    # Amount of formulas canonicalized per transaction when filling missing canonical forms
+    canonical_batch_size: int = 100
+    # Amount of processes filling missing canonical forms in the background
+    backfill_workers: int = 1
+    # Amount of results returned by `/compare` and `/compare_indexes` by default
+    compare_top_k: int = 50
+    # MinHash LSH parameters of the approximate `/compare` mode: `lsh_bands * lsh_rows` hash functions
+    # over shingles of `lsh_shingle` canonical tokens. More bands raise recall, more rows raise precision.
+    lsh_bands: int = 16
+    lsh_rows: int = 4
+    lsh_shingle: int = 2
+    # File every comparison process saves its loaded canonical index to, processes started later only
+    # load formulas changed since. Set to an empty value to always load the whole catalogue.
+    canonical_snapshot: str | None = "/var/cache/wysiwyg/canonical-index.pickle"
+    # Amount of processes comparing formulas (defaults to the amount of CPUs)
+    comparison_workers: int | None = None
+    # Maximal amount of formulas sent to a comparison process at once
+    comparison_chunk_size: int = 256
+    # Seconds a single comparison request may take before its work is aborted
+    comparison_timeout: float = 30
+    # Seconds `/formulas/duplicates` may take, it compares the whole catalogue with itself
+    duplicates_timeout: float = 300
+    # Amount of canonical forms of queried LaTeX kept in memory
+    canonical_cache_size: int = 1024
+    # Share computed canonical forms between backend processes through the database
+    canonical_cache_shared: bool = False
+    # Amount of comparison results kept in memory and seconds they stay valid
+    response_cache_size: int = 1024
+    response_cache_ttl: float = 300
+    # Amount of formulas canonicalized and copied into the database at once by `/formulas/batch`
+    create_batch_size: int = 1000
+    # Amount of rows fetched and scored at once by streaming endpoints
+    stream_batch_size: int = 500
     # AMQP instance used to communicate to the workers running ML models (only used if `ai_worker_enabled` checked)
     amqp_dsn: AmqpDsn | None = Field()
+    # Maximal amount of channels kept open by the AMQP publisher
+    amqp_channel_pool_size: int = 8
     ollama_dsn: str | None = Field()
     ollama_model: str | None = Field()
+    # Maximal amount of chat generations running at once, others wait for a free slot
+    ollama_concurrency: int = 4
     # AMQP queue to send parsing requests to
     ai_pdf_queue: str | None = Field()
     ai_latex_ocr_queue: str | None = Field()
+    # Directory uploaded documents are spooled to, it must be shared with the workers
+    spool_dir: str = "/var/spool/wysiwyg"
+    # Seconds `/parse_screenshot` waits for the worker to recognize a formula
+    ai_latex_ocr_timeout: float = 60
     # Enables `/parse_pdf` endpoint for ML parsing of documents.
     ai_worker_enabled: bool = True
 
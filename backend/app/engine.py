@@ -0,0 +1,129 @@
+import asyncio
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable
+
+from .compare_functions import canonical_array
+from .logging_config import get_logger
+
+
+class ComparisonTimeout(Exception):
+    """Comparison did not finish within the configured timeout."""
+
+
+class ComparisonEngine:
+    """
+    Runs CPU-bound comparison work (sympy parsing, sequence matching) in a pool of processes,
+    so that it does not block the event loop.
+
+    Work on lists is split into chunks that are processed in parallel and merged afterwards.
+    A request that exceeds its timeout restarts the pool, since a process stuck in `simplify()`
+    can not be interrupted otherwise. Tasks of other requests interrupted by the restart are
+    retried once on a new pool.
+
+    State kept by every process, like the canonical index replica, is set up by `initializer(*initargs)`
+    whenever a process is started.
+    """
+
+    def __init__(self, workers: int | None = None, chunk_size: int = 256, timeout: float = 30,
+                 initializer: Callable | None = None, initargs: tuple = ()):
+        self.workers = workers or multiprocessing.cpu_count()
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.initializer = initializer
+        self.initargs = initargs
+        self._executor = self._create_executor()
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        # `spawn` avoids forking the event loop and instrumentation threads of the API process
+        return ProcessPoolExecutor(
+            self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=self.initializer,
+            initargs=self.initargs,
+        )
+
+    def _restart(self):
+        get_logger(__name__).warning("Comparison timed out, restarting process pool")
+        executor, self._executor = self._executor, self._create_executor()
+        # ProcessPoolExecutor has no public way to stop running tasks. Queued tasks of other requests are
+        # not cancelled, they fail with BrokenProcessPool once the processes are gone and are retried in `_call`
+        for process in list(executor._processes.values()):
+            process.terminate()
+        executor.shutdown(wait=False)
+        asyncio.get_running_loop().create_task(self.start())
+
+    async def start(self):
+        """
+        Start all processes of the pool and load the LaTeX parser in them,
+        so that the first requests do not spend their timeout on it.
+        """
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(
+            loop.run_in_executor(self._executor, canonical_array, "x")
+            for _ in range(self.workers)
+        ), return_exceptions=True)
+
+    async def _call(self, fn: Callable, *args) -> Any:
+        loop = asyncio.get_running_loop()
+        executor = self._executor
+        try:
+            return await loop.run_in_executor(executor, fn, *args)
+        except BrokenProcessPool:
+            # The pool was restarted by another request or one of its processes crashed
+            if self._executor is executor:
+                self._executor = self._create_executor()
+            return await loop.run_in_executor(self._executor, fn, *args)
+
+    async def _with_timeout(self, awaitable, timeout: float | None) -> Any:
+        try:
+            return await asyncio.wait_for(awaitable, timeout or self.timeout)
+        except asyncio.TimeoutError:
+            self._restart()
+            raise ComparisonTimeout()
+
+    async def run(self, fn: Callable, *args, timeout: float | None = None) -> Any:
+        """
+        Run `fn(*args)` in the pool.
+
+        :raises ComparisonTimeout: If the call takes longer than the timeout.
+        """
+        return await self._with_timeout(self._call(fn, *args), timeout)
+
+    async def map(self, fn: Callable, items: list, *args, timeout: float | None = None) -> list:
+        """
+        Split `items` into chunks, run `fn(chunk, *args)` for every chunk in parallel and concatenate the results.
+
+        Chunks are sized to spread the items over all workers, but never exceed `chunk_size`.
+
+        :raises ComparisonTimeout: If all chunks are not finished within the timeout.
+        """
+        if not items:
+            return []
+        size = min(self.chunk_size, math.ceil(len(items) / self.workers))
+        chunks = [items[start:start + size] for start in range(0, len(items), size)]
+        parts = await self._with_timeout(
+            asyncio.gather(*(self._call(fn, chunk, *args) for chunk in chunks)),
+            timeout,
+        )
+        return [result for part in parts for result in part]
+
+    async def shards(self, fn: Callable, *args, timeout: float | None = None) -> list:
+        """
+        Run `fn(shard, shards, *args)` for every shard in parallel, with as many shards as workers.
+
+        Used for work on data every process holds itself, so that nothing but the arguments and
+        results is sent between processes.
+
+        :return: Results of all shards in shard order
+        :raises ComparisonTimeout: If all shards are not finished within the timeout.
+        """
+        return await self._with_timeout(
+            asyncio.gather(*(self._call(fn, shard, self.workers, *args) for shard in range(self.workers))),
+            timeout,
+        )
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,64 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+
+import psycopg
+
+from .logging_config import get_logger
+
+CHANNEL = "job_status"
+
+
+class JobEvents:
+    """
+    Single listener of job changes announced by the `jobs_notify` trigger, shared by all clients of the process.
+
+    Every subscriber gets its own bounded queue of events. A subscriber that does not keep up
+    loses its oldest events rather than slowing down the others.
+    """
+
+    def __init__(self, dsn: str, queue_size: int = 100):
+        self.dsn = dsn
+        self.queue_size = queue_size
+        self._subscribers: set[asyncio.Queue] = set()
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._listen())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _listen(self):
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(self.dsn, autocommit=True) as conn:
+                    await conn.execute(f"LISTEN {CHANNEL}")
+                    async for notify in conn.notifies():
+                        self._publish(json.loads(notify.payload))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                get_logger(__name__).warning(f"Job event listener failed, reconnecting: {e}")
+                await asyncio.sleep(1)
+
+    def _publish(self, event: dict):
+        for queue in self._subscribers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    @asynccontextmanager
+    async def subscribe(self):
+        """
+        Receive job events while the context is active.
+
+        :return: Queue of job events
+        """
+        queue = asyncio.Queue(self.queue_size)
+        self._subscribers.add(queue)
+        try:
+            yield queue
+        finally:
+            self._subscribers.discard(queue)
@@ -0,0 +1,392 @@
+import asyncio
+import bisect
+import heapq
+import math
+from array import array
+from collections import Counter
+
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+from .canonical import Backfill
+from .compare_functions import (
+    percent_arrays,
+    prepare_formula,
+    tokenize_formula,
+    intern_formula,
+    find_indexes_prepared,
+    find_indexes,
+    PreparedFormula,
+)
+from .engine import ComparisonEngine, ComparisonTimeout
+from .logging_config import get_logger, DBQueryTimer
+from .lsh import MinHashLSH
+
+# `find_common_blocks` only reports blocks longer than two tokens, so a formula can only have
+# common subexpressions with the query if both share at least one abstracted trigram.
+ABSTRACT_NGRAM = 3
+# Columns of indexed rows returned by the API
+PUBLIC_COLUMNS = ("id", "name", "latex", "source", "description")
+
+
+def ngrams(tokens, n: int) -> set[tuple]:
+    """
+    Collect distinct n-grams of a token sequence.
+
+    :param tokens: Sequence of tokens
+    :param n: Length of n-grams
+    :return: Set of n-gram tuples
+    """
+    return {tuple(tokens[i:i + n]) for i in range(len(tokens) - n + 1)}
+
+
+def score_candidates(candidates: list[tuple[float, int, list[str]]], query: list[str], k: int) -> list[tuple[float, int]]:
+    """
+    Score candidates against the canonical query array and keep the best ones.
+
+    Candidates are scored in order of their upper bound, and scoring stops once no remaining
+    candidate can beat the k-th best exact score.
+
+    :param candidates: List of (upper bound, formula id, canonical array) triples, highest bound first
+    :param query: Canonical array of the query
+    :param k: Amount of results to keep
+    :return: List of (percent, formula id) pairs, best first
+    """
+    best: list[tuple[float, int]] = []
+    for bound, formula_id, canonical in candidates:
+        # Candidates with a bound equal to the k-th score may still win the tie on their id
+        if len(best) >= k and bound < best[0][0]:
+            break
+        score = percent_arrays(query, canonical)
+        if len(best) < k:
+            heapq.heappush(best, (score, formula_id))
+        else:
+            heapq.heappushpop(best, (score, formula_id))
+    return sorted(best, reverse=True)
+
+
+def tokenize_many(latexes: list[str]) -> list[tuple[list[str], list[str], array]]:
+    """
+    Tokenize several formulas without interning their tokens, see `tokenize_formula`.
+    """
+    return [tokenize_formula(latex) for latex in latexes]
+
+
+def find_indexes_many(formulas: list[tuple[int, PreparedFormula]], query: PreparedFormula) -> list[tuple[int, list[tuple[int, int]]]]:
+    """
+    Find common subexpressions of the query and several formulas, see `find_indexes`.
+
+    :param formulas: List of (formula id, prepared formula) pairs
+    :param query: Prepared query
+    :return: List of (formula id, indexes) pairs
+    """
+    return [(formula_id, find_indexes_prepared(formula, query)) for formula_id, formula in formulas]
+
+
+def percent_many(formulas: list[tuple[int, list[str]]], query: list[str]) -> list[tuple[int, float]]:
+    """
+    Score several formulas against the canonical query array without pruning.
+
+    :param formulas: List of (formula id, canonical array) pairs
+    :param query: Canonical array of the query
+    :return: List of (formula id, percent) pairs in input order
+    """
+    return [(formula_id, percent_arrays(query, canonical)) for formula_id, canonical in formulas]
+
+
+def find_indexes_latex_many(formulas: list[tuple[int, str]], latex: str) -> list[tuple[int, list[tuple[int, int]]]]:
+    """
+    Find common subexpressions of the query and several formulas that were not prepared beforehand.
+
+    :param formulas: List of (formula id, LaTeX) pairs
+    :param latex: LaTeX of the query
+    :return: List of (formula id, indexes) pairs in input order
+    """
+    return [(formula_id, find_indexes(formula, latex)) for formula_id, formula in formulas]
+
+
+class CanonicalIndex:
+    """
+    In-memory index of canonical arrays used by `/compare`.
+
+    Keeps posting lists of canonical tokens, mapping each of them to ids of formulas containing it.
+    `percent_arrays` credits single matching tokens, so only formulas sharing no canonical token
+    with the query may be left out of an exact search.
+    Canonical arrays are also kept in a MinHash LSH table for approximate search.
+    Searches can be restricted to a shard of formula ids, those with `id % shards == shard`,
+    so that a search is split over the processes of the comparison engine, see `replica`.
+    """
+
+    def __init__(self, lsh: MinHashLSH | None = None):
+        self.lsh = lsh or MinHashLSH()
+        self.canonical: dict[int, list[str]] = {}
+        self.version = -1
+        self.revision = -1
+        self._counts: dict[int, Counter] = {}
+        self._tokens: dict[int, set] = {}
+        self._postings: dict[str, set[int]] = {}
+
+    def add(self, formula_id: int, canonical: list[str], lsh_keys: list[tuple] | None = None):
+        """
+        Add a formula to the index, replacing a previously indexed version of it.
+
+        :param lsh_keys: Band keys of the formula in the LSH table, see `MinHashLSH.add`
+        """
+        self.remove(formula_id)
+        self.canonical[formula_id] = canonical
+        self._counts[formula_id] = Counter(canonical)
+        self._tokens[formula_id] = set(canonical)
+        for token in self._tokens[formula_id]:
+            self._postings.setdefault(token, set()).add(formula_id)
+        self.lsh.add(formula_id, canonical, lsh_keys)
+
+    def snapshot(self) -> dict:
+        """
+        Export the indexed formulas with their LSH band keys, which take most of the time of `add`.
+
+        :return: Snapshot to be passed to `restore`
+        """
+        return {
+            "version": self.version,
+            "revision": self.revision,
+            "lsh": self.lsh.parameters(),
+            "formulas": [
+                (formula_id, canonical, self.lsh.band_keys(formula_id))
+                for formula_id, canonical in self.canonical.items()
+            ],
+        }
+
+    def restore(self, snapshot: dict) -> bool:
+        """
+        Add the formulas of a snapshot taken by `snapshot`, and follow its catalogue version.
+
+        :return: Whether the snapshot was restored, it is not if it was taken with other LSH parameters
+        """
+        if tuple(snapshot["lsh"]) != self.lsh.parameters():
+            return False
+        for formula_id, canonical, lsh_keys in snapshot["formulas"]:
+            self.add(formula_id, canonical, lsh_keys)
+        self.version = snapshot["version"]
+        self.revision = snapshot["revision"]
+        return True
+
+    def remove(self, formula_id: int):
+        """
+        Remove a formula from the index if present.
+        """
+        if self.canonical.pop(formula_id, None) is None:
+            return
+        del self._counts[formula_id]
+        for token in self._tokens.pop(formula_id):
+            self._postings[token].discard(formula_id)
+        self.lsh.remove(formula_id)
+
+    def bound(self, query: Counter, query_length: int, formula_id: int) -> float:
+        """
+        Upper bound of `percent_arrays` between the query and an indexed formula.
+
+        Matching blocks form a common subsequence, so they can not cover more tokens than
+        the multiset intersection of both arrays.
+        """
+        counts = self._counts[formula_id]
+        length = counts.total()
+        if not query_length or not length:
+            return 0.0
+        return sum((query & counts).values()) / max(query_length, length) * 100
+
+    def canonical_candidates(self, query: list[str], shard: int = 0, shards: int = 1) -> set[int]:
+        """
+        Ids of formulas of the shard sharing at least one canonical token with the query.
+        """
+        candidates = set()
+        for token in set(query):
+            candidates |= self._postings.get(token, set())
+        if shards > 1:
+            candidates = {formula_id for formula_id in candidates if formula_id % shards == shard}
+        return candidates
+
+    def candidates(self, query: list[str], shard: int = 0, shards: int = 1) -> list[tuple[float, int, list[str]]]:
+        """
+        Exact search candidates for the canonical query array, see `score_candidates`.
+
+        :return: List of (upper bound, formula id, canonical array) triples, highest bound first
+        """
+        counts = Counter(query)
+        return sorted(
+            ((self.bound(counts, len(query), formula_id), formula_id, self.canonical[formula_id])
+             for formula_id in self.canonical_candidates(query, shard, shards)),
+            reverse=True,
+        )
+
+    def approximate_candidates(self, query: list[str], shard: int = 0, shards: int = 1) -> list[tuple[float, int, list[str]]]:
+        """
+        Formulas of the shard colliding with the canonical query array in the LSH table, in `score_candidates` format.
+
+        Results may miss formulas the exact search would return.
+        """
+        return [
+            (100.0, formula_id, self.canonical[formula_id])
+            for formula_id in self.lsh.candidates(query)
+            if formula_id % shards == shard
+        ]
+
+    def top_percent(self, query: list[str], k: int, shard: int = 0, shards: int = 1) -> list[tuple[float, int]]:
+        """
+        Find formulas of the shard most similar to the canonical query array.
+
+        :return: List of (percent, formula id) pairs, best first
+        """
+        return score_candidates(self.candidates(query, shard, shards), query, k)
+
+    def approximate_percent(self, query: list[str], k: int, shard: int = 0, shards: int = 1) -> list[tuple[float, int]]:
+        """
+        Find formulas of the shard similar to the canonical query array using the LSH table.
+
+        :return: List of (percent, formula id) pairs, best first
+        """
+        return score_candidates(self.approximate_candidates(query, shard, shards), query, k)
+
+    def duplicates(self, threshold: float, shard: int = 0, shards: int = 1) -> list[tuple[int, int, float]]:
+        """
+        Find pairs of formulas at least `threshold` percent similar, with the lower id in the shard.
+
+        `percent_arrays` can not exceed the ratio of both lengths, so every formula is only bounded
+        against formulas of similar length, and pairs are scored as soon as they are found.
+
+        :return: List of (formula id, other formula id, percent) triples
+        """
+        by_length = sorted((len(canonical), formula_id) for formula_id, canonical in self.canonical.items() if canonical)
+        lengths = [length for length, _ in by_length]
+        result = []
+        for length, formula_id in by_length:
+            if formula_id % shards != shard:
+                continue
+            canonical = self.canonical[formula_id]
+            counts = self._counts[formula_id]
+            # Rounded outwards, the bound below is the exact check
+            start = bisect.bisect_left(lengths, math.floor(length * threshold / 100))
+            stop = bisect.bisect_right(lengths, math.ceil(length * 100 / threshold))
+            for _, other_id in by_length[start:stop]:
+                if other_id <= formula_id or self.bound(counts, length, other_id) < threshold:
+                    continue
+                score = percent_arrays(canonical, self.canonical[other_id])
+                if score >= threshold:
+                    result.append((formula_id, other_id, score))
+        return result
+
+
+class FormulaIndex:
+    """
+    In-memory index over stored formulas used by `/compare_indexes`, also holding the rows returned by the API.
+
+    Keeps posting lists of abstracted token trigrams, mapping each of them to ids of formulas containing it.
+    Formulas are also kept tokenized, so that `/compare_indexes` only has to match them.
+    Canonical arrays used by `/compare` are not kept here, every process of the comparison engine
+    loads them into its own `CanonicalIndex`, see `replica`.
+    The index follows the `catalogue` version in the database and only loads rows whose revision
+    is newer than the last one seen.
+    """
+
+    def __init__(self, batch_size: int = 100, engine: ComparisonEngine | None = None,
+                 backfill: Backfill | None = None):
+        self.batch_size = batch_size
+        self.engine = engine
+        self.backfill = backfill
+        self.formulas: dict[int, dict] = {}
+        self.prepared: dict[int, PreparedFormula] = {}
+        self.version = -1
+        self.revision = -1
+        self._abstract_grams: dict[int, set] = {}
+        self._abstract_postings: dict[tuple, set[int]] = {}
+        self._lock = asyncio.Lock()
+
+    def add(self, row: dict, prepared: PreparedFormula | None = None):
+        """
+        Add a formula to the index, replacing a previously indexed version of it.
+
+        :param row: Formula row with `id`, `name`, `latex`, `source` and `description` keys
+        :param prepared: Tokenized LaTeX of the formula, it is computed when missing
+        """
+        self.remove(row["id"])
+        formula_id = row["id"]
+        if prepared is None:
+            prepared = prepare_formula(row["latex"] or "")
+        self.formulas[formula_id] = {key: row[key] for key in PUBLIC_COLUMNS}
+        self.prepared[formula_id] = prepared
+        self._abstract_grams[formula_id] = ngrams(prepared.abstracted, ABSTRACT_NGRAM)
+        for gram in self._abstract_grams[formula_id]:
+            self._abstract_postings.setdefault(gram, set()).add(formula_id)
+
+    def remove(self, formula_id: int):
+        """
+        Remove a formula from the index if present.
+        """
+        if self.formulas.pop(formula_id, None) is None:
+            return
+        del self.prepared[formula_id]
+        for gram in self._abstract_grams.pop(formula_id):
+            self._abstract_postings[gram].discard(formula_id)
+
+    async def _prepare(self, latexes: list[str]) -> list[PreparedFormula]:
+        if self.engine is None:
+            tokenized = tokenize_many(latexes)
+        else:
+            try:
+                tokenized = await self.engine.map(tokenize_many, latexes)
+            except ComparisonTimeout:
+                # Tokenizing does not hang, the pool was busy with other work
+                tokenized = tokenize_many(latexes)
+        # Tokens are interned here, ids interned by engine processes would not match those of queries
+        return [intern_formula(*formula) for formula in tokenized]
+
+    async def add_many(self, rows: list[dict]):
+        """
+        Add several formulas to the index, tokenizing them in the comparison engine in batches,
+        so that indexing many formulas does not block the event loop.
+
+        :param rows: Formula rows, see `add`
+        """
+        for start in range(0, len(rows), self.batch_size):
+            batch = rows[start:start + self.batch_size]
+            prepared = await self._prepare([row["latex"] or "" for row in batch])
+            for row, formula in zip(batch, prepared):
+                self.add(row, formula)
+
+    async def refresh(self, pool: AsyncConnectionPool):
+        """
+        Load formulas changed since the last refresh.
+
+        Costs a single lookup of the catalogue version when nothing changed. Loaded rows that lack
+        a canonical array are indexed right away and start the `backfill`, which stores their canonical
+        arrays in the background; the replicas of the canonical index load them once they are stored.
+        """
+        async with self._lock:
+            with DBQueryTimer("select"):
+                async with pool.connection() as conn:
+                    cur = conn.cursor(row_factory=dict_row)
+                    await cur.execute("SELECT version FROM catalogue")
+                    version = (await cur.fetchone())["version"]
+                    if version == self.version:
+                        return
+                    await cur.execute(
+                        "SELECT id, name, latex, source, description, canonical IS NULL AS missing, revision "
+                        "FROM formulas WHERE revision > %s ORDER BY revision",
+                        (self.revision,),
+                    )
+                    rows = await cur.fetchall()
+            if self.backfill is not None and any(row["missing"] for row in rows):
+                self.backfill.start()
+            await self.add_many(rows)
+            self.revision = max([self.revision] + [row["revision"] for row in rows])
+            self.version = version
+        if rows:
+            get_logger(__name__).info(f"Indexed {len(rows)} formulas, catalogue version {version}")
+
+    def abstract_candidates(self, query: PreparedFormula) -> set[int]:
+        """
+        Ids of formulas that may have common subexpressions with the prepared query.
+        """
+        candidates = set()
+        for gram in ngrams(query.abstracted, ABSTRACT_NGRAM):
+            candidates |= self._abstract_postings.get(gram, set())
+        return candidates
@@ -10,7 +10,7 @@ from opentelemetry.instrumentation.pika import PikaInstrumentor
 from opentelemetry.sdk.resources import Resource, SERVICE_NAME
 from opentelemetry.sdk.trace import TracerProvider
 from opentelemetry.sdk.trace.export import SimpleSpanProcessor
-from prometheus_client import Counter, Histogram
+from prometheus_client import Counter, Gauge, Histogram
 
 from .config import Settings
 
@@ -78,6 +78,54 @@ RABBITMQ_MESSAGE_COUNT = Counter(
     ["queue", "status"]
 )
 
+AMQP_CHANNELS = Gauge(
+    "amqp_publisher_channels",
+    "Amount of open channels in the AMQP publisher pool"
+)
+
+AMQP_CONFIRM_LATENCY = Histogram(
+    "amqp_publish_confirm_duration_seconds",
+    "Time between publishing an AMQP message and its broker confirmation",
+    ["queue"]
+)
+
+AMQP_PENDING_CALLS = Gauge(
+    "amqp_pending_calls",
+    "Amount of AMQP requests waiting for a worker reply"
+)
+
+AMQP_RECONNECTS = Counter(
+    "amqp_reconnects_total",
+    "Total number of AMQP connection recoveries"
+)
+
+CANONICAL_CACHE_HITS = Counter(
+    "canonical_cache_hits_total",
+    "Total number of canonical form cache hits",
+    ["tier"]
+)
+
+CANONICAL_CACHE_MISSES = Counter(
+    "canonical_cache_misses_total",
+    "Total number of canonical form cache misses"
+)
+
+CANONICAL_CACHE_EVICTIONS = Counter(
+    "canonical_cache_evictions_total",
+    "Total number of canonical forms evicted from the in-memory cache"
+)
+
+RESPONSE_CACHE_HITS = Counter(
+    "response_cache_hits_total",
+    "Total number of comparison results served from the response cache",
+    ["tier"]
+)
+
+RESPONSE_CACHE_MISSES = Counter(
+    "response_cache_misses_total",
+    "Total number of comparison results computed"
+)
+
 
 # Middleware for logging requests and responses
 async def logging_middleware(request: Any, call_next: Any) -> Any:
@@ -0,0 +1,105 @@
+import random
+import zlib
+
+# Mersenne prime used as the modulus of the universal hash family
+_PRIME = (1 << 61) - 1
+
+
+def shingles(tokens: list[str], size: int) -> set[tuple[str, ...]]:
+    """
+    Collect token shingles of a canonical array. Arrays shorter than a shingle form a single one.
+
+    :param tokens: Canonical array
+    :param size: Amount of tokens in a shingle
+    :return: Set of shingle tuples
+    """
+    if len(tokens) <= size:
+        return {tuple(tokens)} if tokens else set()
+    return {tuple(tokens[i:i + size]) for i in range(len(tokens) - size + 1)}
+
+
+class MinHashLSH:
+    """
+    Banded locality-sensitive hashing table over MinHash signatures of canonical arrays.
+
+    A signature has `bands * rows` values. Two formulas become candidates of each other when all
+    values of at least one band match, which happens with probability `1 - (1 - J^rows)^bands`
+    for Jaccard similarity `J` of their shingle sets. More bands raise recall, more rows raise precision.
+    """
+
+    def __init__(self, bands: int = 16, rows: int = 4, shingle: int = 2, seed: int = 1):
+        self.bands = bands
+        self.rows = rows
+        self.shingle = shingle
+        self.seed = seed
+        generator = random.Random(seed)
+        self._permutations = [
+            (generator.randrange(1, _PRIME), generator.randrange(0, _PRIME))
+            for _ in range(bands * rows)
+        ]
+        self._tables: list[dict[tuple, set[int]]] = [{} for _ in range(bands)]
+        self._keys: dict[int, list[tuple]] = {}
+
+    def signature(self, tokens: list[str]) -> list[int] | None:
+        """
+        Compute the MinHash signature of a canonical array.
+
+        :return: Signature or None for an empty array
+        """
+        # A stable hash, so that signatures stay valid in other processes, see `band_keys`
+        hashes = [zlib.crc32("\0".join(s).encode()) for s in shingles(tokens, self.shingle)]
+        if not hashes:
+            return None
+        return [min((a * h + b) % _PRIME for h in hashes) for a, b in self._permutations]
+
+    def _band_keys(self, signature: list[int]) -> list[tuple]:
+        return [tuple(signature[band * self.rows:(band + 1) * self.rows]) for band in range(self.bands)]
+
+    def parameters(self) -> tuple[int, int, int, int]:
+        """
+        Parameters band keys depend on, tables with equal parameters can share them.
+        """
+        return self.bands, self.rows, self.shingle, self.seed
+
+    def band_keys(self, formula_id: int) -> list[tuple] | None:
+        """
+        Band keys of an inserted formula, they can be passed to `add` of a table with equal `parameters`.
+        """
+        return self._keys.get(formula_id)
+
+    def add(self, formula_id: int, tokens: list[str], keys: list[tuple] | None = None):
+        """
+        Insert a formula into the table, replacing a previously inserted version of it.
+
+        :param keys: Band keys of the formula from `band_keys`, computed from `tokens` when missing
+        """
+        self.remove(formula_id)
+        if keys is None:
+            signature = self.signature(tokens)
+            if signature is None:
+                return
+            keys = self._band_keys(signature)
+        for table, key in zip(self._tables, keys):
+            table.setdefault(key, set()).add(formula_id)
+        self._keys[formula_id] = keys
+
+    def remove(self, formula_id: int):
+        """
+        Remove a formula from the table if present.
+        """
+        for table, key in zip(self._tables, self._keys.pop(formula_id, [])):
+            table[key].discard(formula_id)
+            if not table[key]:
+                del table[key]
+
+    def candidates(self, tokens: list[str]) -> set[int]:
+        """
+        Ids of formulas sharing at least one band with the given canonical array.
+        """
+        signature = self.signature(tokens)
+        if signature is None:
+            return set()
+        result = set()
+        for table, key in zip(self._tables, self._band_keys(signature)):
+            result |= table.get(key, set())
+        return result
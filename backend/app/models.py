@@ -1,7 +1,9 @@
-from typing import Literal
+from typing import Generic, Literal, TypeVar
 import datetime
 from pydantic import BaseModel
 
+T = TypeVar("T")
+
 
 class Formula(BaseModel):
     name: str
@@ -18,6 +20,32 @@ class JobStatus(BaseModel):
     id: int
     status: Literal["pnd", "prc", "suc", "err", "arc"]
     datetime: datetime.datetime
+    # Progress of document conversion, known once the worker started processing the job
+    pages_done: int | None = None
+    pages_total: int | None = None
+
+
+class Page(BaseModel, Generic[T]):
+    items: list[T]
+    # Cursor to pass as `after` to get the next page, None on the last page
+    next: int | None
+
+
+class Similarity(BaseModel):
+    id: int
+    formula: str
+    percent: float
+
+
+class CompareResponse(BaseModel):
+    mode: Literal["exact", "approximate"]
+    results: list[Similarity]
+
+
+class Duplicate(BaseModel):
+    id: int
+    other: int
+    percent: float
 
 
 class FormulaWithIndex(Formula):
@@ -0,0 +1,178 @@
+import fcntl
+import hashlib
+import os
+import pickle
+import stat
+import tempfile
+import threading
+
+import psycopg
+
+from .index import CanonicalIndex
+from .logging_config import get_logger
+from .lsh import MinHashLSH
+
+# Largest amount of changed formulas a search loads itself, larger changes are loaded in the background
+INLINE_SYNC_ROWS = 1000
+
+# Canonical index of the current process of the comparison engine, see `configure`
+_index: CanonicalIndex | None = None
+_dsn: str | None = None
+_snapshot: str | None = None
+_lock = threading.Lock()
+_ready = threading.Event()
+_loader: threading.Thread | None = None
+
+
+class ReplicaNotReady(Exception):
+    """The canonical index of a comparison engine process is still being loaded."""
+
+
+def configure(dsn: str, lsh_bands: int, lsh_rows: int, lsh_shingle: int, snapshot: str | None = None):
+    """
+    Initializer of comparison engine processes.
+
+    Every process keeps its own replica of the canonical index, so that the API process only sends
+    queries and receives formula ids with their scores. The replica is loaded in a background thread,
+    searches raise `ReplicaNotReady` meanwhile instead of waiting for it. The loaded index is saved
+    to the `snapshot` file, so that processes started later, e.g. after a timeout restarted the pool,
+    only load formulas changed since.
+    """
+    global _index, _dsn, _snapshot
+    _dsn = dsn
+    _snapshot = snapshot
+    _index = CanonicalIndex(MinHashLSH(lsh_bands, lsh_rows, lsh_shingle))
+    _start_loader()
+
+
+def _start_loader():
+    global _loader
+    _ready.clear()
+    if _loader is None or not _loader.is_alive():
+        _loader = threading.Thread(target=_load, daemon=True)
+        _loader.start()
+
+
+def _load():
+    try:
+        with _lock:
+            if _index.version < 0 and _snapshot is not None:
+                _restore()
+            current, rows = _fetch()
+            _apply(current, rows)
+            if rows and _snapshot is not None:
+                _save()
+        _ready.set()
+    except Exception as e:
+        get_logger(__name__).warning(f"Loading canonical index failed, it is retried on the next search: {e}")
+
+
+def _fetch(limit: int | None = None) -> tuple[int, list[tuple]]:
+    with psycopg.connect(_dsn) as conn:
+        current = conn.execute("SELECT version FROM catalogue").fetchone()[0]
+        rows = conn.execute(
+            "SELECT id, canonical, revision FROM formulas WHERE revision > %s ORDER BY revision LIMIT %s",
+            (_index.revision, limit),
+        ).fetchall()
+    return current, rows
+
+
+def _apply(current: int, rows: list[tuple]):
+    for formula_id, canonical, revision in rows:
+        _index.revision = max(_index.revision, revision)
+        _index.add(formula_id, canonical or [])
+    _index.version = current
+    if rows:
+        get_logger(__name__).info(f"Replicated {len(rows)} canonical arrays, catalogue version {current}")
+
+
+def _source() -> str:
+    # Snapshots of another database are ignored, the DSN itself is not written since it contains the password
+    return hashlib.sha256(_dsn.encode()).hexdigest()
+
+
+def _restore():
+    try:
+        with open(_snapshot, "rb") as file:
+            info = os.fstat(file.fileno())
+            # Snapshots are unpickled, so only files no other user could have written are trusted
+            if info.st_uid != os.getuid() or info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+                get_logger(__name__).warning(f"Ignoring canonical index snapshot {_snapshot} of another user")
+                return
+            snapshot = pickle.load(file)
+    except FileNotFoundError:
+        return
+    except Exception as e:
+        get_logger(__name__).warning(f"Ignoring unreadable canonical index snapshot {_snapshot}: {e}")
+        return
+    if snapshot.get("source") == _source() and _index.restore(snapshot):
+        get_logger(__name__).info(f"Restored {len(_index.canonical)} canonical arrays from {_snapshot}")
+
+
+def _save():
+    directory = os.path.dirname(_snapshot) or "."
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with open(f"{_snapshot}.lock", "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another process is saving the same catalogue
+                return
+            fd, path = tempfile.mkstemp(dir=directory)
+            try:
+                with os.fdopen(fd, "wb") as file:
+                    pickle.dump({"source": _source(), **_index.snapshot()}, file, pickle.HIGHEST_PROTOCOL)
+                os.replace(path, _snapshot)
+            except BaseException:
+                os.unlink(path)
+                raise
+    except OSError as e:
+        get_logger(__name__).warning(f"Saving canonical index snapshot failed: {e}")
+
+
+def sync(version: int) -> CanonicalIndex:
+    """
+    Get the canonical index of the current process following at least `version` of the catalogue.
+
+    A few changed formulas are loaded right away, more of them are loaded in the background.
+
+    :param version: Catalogue version the caller has seen
+    :raises ReplicaNotReady: If the index is being loaded.
+    """
+    if not _ready.is_set():
+        _start_loader()
+        raise ReplicaNotReady()
+    with _lock:
+        if _index.version >= version:
+            return _index
+        current, rows = _fetch(INLINE_SYNC_ROWS + 1)
+        if len(rows) > INLINE_SYNC_ROWS:
+            _start_loader()
+            raise ReplicaNotReady()
+        _apply(current, rows)
+    return _index
+
+
+def top_percent_shard(shard: int, shards: int, version: int, queries: list[list[str]], k: int,
+                      approximate: bool = False) -> list[list[tuple[float, int]]]:
+    """
+    Find formulas of a shard most similar to each of the canonical query arrays, see `CanonicalIndex.top_percent`.
+
+    :param version: Catalogue version the replica has to follow at least
+    :param approximate: Whether only formulas colliding with a query in the LSH table are scored
+    :return: List of (percent, formula id) pairs of every query, best first, none for empty queries
+    """
+    index = sync(version)
+    search = index.approximate_percent if approximate else index.top_percent
+    return [search(query, k, shard, shards) if query else [] for query in queries]
+
+
+def duplicates_shard(shard: int, shards: int, version: int, threshold: float) -> list[tuple[int, int, float]]:
+    """
+    Find pairs of formulas at least `threshold` percent similar whose lower id is in the shard.
+
+    :param version: Catalogue version the replica has to follow at least
+    :return: List of (formula id, other formula id, percent) triples
+    """
+    return sync(version).duplicates(threshold, shard, shards)
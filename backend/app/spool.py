@@ -0,0 +1,37 @@
+import hashlib
+import os
+import uuid
+from typing import BinaryIO
+
+
+def spool_upload(source: BinaryIO, directory: str, suffix: str = "", chunk_size: int = 1 << 20) -> tuple[str, str, int]:
+    """
+    Copy an uploaded file into the spool directory chunk by chunk, hashing it on the way.
+
+    The file is written under a temporary name and renamed once complete, so that readers
+    never see a partially written file.
+
+    :param source: File object of the upload
+    :param directory: Spool directory shared with the workers
+    :param suffix: Extension of the spooled file
+    :param chunk_size: Amount of bytes read at once
+    :return: Path of the spooled file, hex SHA-256 of its content and its size
+    """
+    os.makedirs(directory, exist_ok=True)
+    name = uuid.uuid4().hex
+    partial = os.path.join(directory, f".{name}.part")
+    path = os.path.join(directory, name + suffix)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(partial, "wb") as target:
+            while chunk := source.read(chunk_size):
+                digest.update(chunk)
+                target.write(chunk)
+                size += len(chunk)
+        os.replace(partial, path)
+    except BaseException:
+        if os.path.exists(partial):
+            os.unlink(partial)
+        raise
+    return path, digest.hexdigest(), size
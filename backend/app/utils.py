@@ -9,3 +9,8 @@ def require(flag: bool, message: str):
         return f
 
     return _inner
+
+
+def escape_like(value: str) -> str:
+    """Escape LIKE pattern characters, so that the value is matched literally."""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
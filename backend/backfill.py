@@ -0,0 +1,43 @@
+import asyncio
+from sys import argv
+
+from psycopg_pool import AsyncConnectionPool
+
+from app.canonical import backfill
+from app.engine import ComparisonEngine
+
+
+async def run(dsn: str, batch_size: int):
+    engine = ComparisonEngine()
+    try:
+        async with AsyncConnectionPool(dsn, max_size=2) as pool:
+            count = await backfill(pool, engine, batch_size)
+    finally:
+        engine.close()
+    print(f"Computed canonical forms for {count} formulas")
+
+
+def main(args):
+    match len(args):
+        case 0:
+            print("No arguments provided, exiting...")
+            exit(0)
+        case a if "-h" in args:
+            print("backfill.py -h")
+            print("Computes canonical forms of all stored formulas that do not have one yet.")
+            print("The backend also does it in the background, this is meant for large imports and migrations.")
+            print("Possible arguments:")
+            print("    backfill.py <database-dsn> [batch-size]")
+            exit(0)
+        case a if a <= 2:
+            dsn = args[0]
+            batch_size = int(args[1]) if a > 1 else 100
+        case _:
+            print("Too many arguments provided, exiting...")
+            exit(1)
+    asyncio.run(run(dsn, batch_size))
+
+
+if __name__ == "__main__":
+    args = argv[1:]
+    main(args)
@@ -0,0 +1,79 @@
+import random
+import time
+from sys import argv
+
+import psycopg
+
+from app.canonical import canonicalize
+from app.index import CanonicalIndex
+from app.lsh import MinHashLSH
+
+# (bands, rows) pairs compared against the exact scan
+LSH_CONFIGURATIONS = [(8, 8), (16, 4), (32, 2), (64, 1)]
+
+
+def load_formulas(db: psycopg.Connection) -> list[dict]:
+    print("Loading formulas...")
+    rows = db.execute("SELECT id, latex, canonical FROM formulas").fetchall()
+    return [
+        {"id": formula_id, "canonical": canonical if canonical is not None else canonicalize(latex)}
+        for formula_id, latex, canonical in rows
+    ]
+
+
+def measure(search, queries: list[list[str]], k: int) -> tuple[list[set[int]], float]:
+    results = []
+    start = time.perf_counter()
+    for query in queries:
+        results.append({formula_id for _, formula_id in search(query, k)})
+    return results, (time.perf_counter() - start) / len(queries) * 1000
+
+
+def benchmark(formulas: list[dict], query_count: int, k: int):
+    queries = [row["canonical"] for row in random.sample(formulas, min(query_count, len(formulas))) if row["canonical"]]
+    if not queries:
+        print("No parseable formulas to query, exiting...")
+        exit(1)
+    print(f"Formulas: {len(formulas)}, queries: {len(queries)}, k: {k}")
+    print(f"{'mode':<24}{'latency, ms':>14}{'recall@k':>12}")
+    exact_index = CanonicalIndex()
+    for row in formulas:
+        exact_index.add(row["id"], row["canonical"])
+    exact, latency = measure(exact_index.top_percent, queries, k)
+    print(f"{'exact':<24}{latency:>14.2f}{1:>12.3f}")
+    for bands, rows in LSH_CONFIGURATIONS:
+        index = CanonicalIndex(MinHashLSH(bands, rows))
+        for row in formulas:
+            index.add(row["id"], row["canonical"])
+        approximate, latency = measure(index.approximate_percent, queries, k)
+        recall = sum(
+            len(found & expected) / len(expected) if expected else 1
+            for found, expected in zip(approximate, exact)
+        ) / len(queries)
+        print(f"{f'approximate {bands}x{rows}':<24}{latency:>14.2f}{recall:>12.3f}")
+
+
+def main(args):
+    match len(args):
+        case 0:
+            print("No arguments provided, exiting...")
+            exit(0)
+        case a if "-h" in args:
+            print("benchmark.py -h")
+            print("Compares recall@k and latency of approximate `/compare` mode against the exact one.")
+            print("Possible arguments:")
+            print("    benchmark.py <database-dsn> [queries] [k]")
+            exit(0)
+        case a if a <= 3:
+            db = psycopg.connect(args[0])
+            query_count = int(args[1]) if a > 1 else 100
+            k = int(args[2]) if a > 2 else 10
+        case _:
+            print("Too many arguments provided, exiting...")
+            exit(1)
+    benchmark(load_formulas(db), query_count, k)
+
+
+if __name__ == "__main__":
+    args = argv[1:]
+    main(args)
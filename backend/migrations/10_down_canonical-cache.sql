@@ -0,0 +1 @@
+DROP TABLE canonical_cache;
\ No newline at end of file
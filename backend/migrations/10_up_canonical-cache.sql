@@ -0,0 +1,4 @@
+CREATE TABLE canonical_cache (
+    latex TEXT PRIMARY KEY,
+    canonical TEXT[] NOT NULL
+);
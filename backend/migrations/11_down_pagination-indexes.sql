@@ -0,0 +1,3 @@
+DROP INDEX jobs_status_id_idx;
+DROP INDEX formulas_source_id_idx;
+DROP INDEX formulas_name_trgm_idx;
\ No newline at end of file
@@ -0,0 +1,5 @@
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX formulas_name_trgm_idx ON formulas USING gin (name gin_trgm_ops);
+CREATE INDEX formulas_source_id_idx ON formulas(source, id);
+CREATE INDEX jobs_status_id_idx ON jobs(status, id);
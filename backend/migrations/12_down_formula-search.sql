@@ -0,0 +1,3 @@
+DROP INDEX formulas_latex_trgm_idx;
+DROP INDEX formulas_search_idx;
+ALTER TABLE formulas DROP COLUMN search;
\ No newline at end of file
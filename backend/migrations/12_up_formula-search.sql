@@ -0,0 +1,7 @@
+ALTER TABLE formulas ADD COLUMN search tsvector GENERATED ALWAYS AS (
+    setweight(to_tsvector('simple', coalesce(name, '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce(description, '')), 'B')
+) STORED;
+
+CREATE INDEX formulas_search_idx ON formulas USING gin (search);
+CREATE INDEX formulas_latex_trgm_idx ON formulas USING gin (latex gin_trgm_ops);
@@ -0,0 +1,4 @@
+ALTER TABLE jobs DROP COLUMN resource_id;
+DROP INDEX resources_sha256_idx;
+ALTER TABLE resources DROP COLUMN size;
+ALTER TABLE resources DROP COLUMN sha256;
\ No newline at end of file
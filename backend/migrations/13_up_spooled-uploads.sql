@@ -0,0 +1,5 @@
+ALTER TABLE resources ADD COLUMN sha256 CHAR(64);
+ALTER TABLE resources ADD COLUMN size BIGINT;
+CREATE INDEX resources_sha256_idx ON resources(sha256);
+
+ALTER TABLE jobs ADD COLUMN resource_id INT REFERENCES resources(id);
@@ -0,0 +1,4 @@
+DROP TABLE ocr_cache;
+DROP INDEX import_results_sha256_idx;
+ALTER TABLE import_results DROP COLUMN pipeline;
+ALTER TABLE import_results DROP COLUMN sha256;
\ No newline at end of file
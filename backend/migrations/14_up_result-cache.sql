@@ -0,0 +1,10 @@
+ALTER TABLE import_results ADD COLUMN sha256 CHAR(64);
+ALTER TABLE import_results ADD COLUMN pipeline TEXT;
+CREATE INDEX import_results_sha256_idx ON import_results(sha256, pipeline);
+
+CREATE TABLE ocr_cache (
+    sha256 CHAR(64),
+    model TEXT,
+    latex TEXT NOT NULL,
+    PRIMARY KEY (sha256, model)
+);
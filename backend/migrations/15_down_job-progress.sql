@@ -0,0 +1,2 @@
+ALTER TABLE jobs DROP COLUMN pages_total;
+ALTER TABLE jobs DROP COLUMN pages_done;
\ No newline at end of file
@@ -0,0 +1,2 @@
+ALTER TABLE jobs ADD COLUMN pages_done INT;
+ALTER TABLE jobs ADD COLUMN pages_total INT;
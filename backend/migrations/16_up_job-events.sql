@@ -0,0 +1,18 @@
+-- Every change of a job is announced on the `job_status` channel, the backend forwards it to subscribed clients
+CREATE FUNCTION jobs_notify() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('job_status', json_build_object(
+        'id', NEW.id,
+        'status', NEW.status,
+        'datetime', NEW.datetime,
+        'pages_done', NEW.pages_done,
+        'pages_total', NEW.pages_total
+    )::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER jobs_notify
+    AFTER INSERT OR UPDATE ON jobs
+    FOR EACH ROW
+    EXECUTE FUNCTION jobs_notify();
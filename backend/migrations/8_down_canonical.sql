@@ -0,0 +1,3 @@
+DROP TRIGGER formulas_reset_canonical ON formulas;
+DROP FUNCTION formulas_reset_canonical();
+ALTER TABLE formulas DROP COLUMN canonical;
\ No newline at end of file
@@ -0,0 +1,14 @@
+ALTER TABLE formulas ADD COLUMN canonical TEXT[];
+
+CREATE FUNCTION formulas_reset_canonical() RETURNS trigger AS $$
+BEGIN
+    NEW.canonical := NULL;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER formulas_reset_canonical
+    BEFORE UPDATE OF latex ON formulas
+    FOR EACH ROW
+    WHEN (OLD.latex IS DISTINCT FROM NEW.latex AND OLD.canonical IS NOT DISTINCT FROM NEW.canonical)
+    EXECUTE FUNCTION formulas_reset_canonical();
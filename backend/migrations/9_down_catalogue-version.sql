@@ -0,0 +1,6 @@
+DROP TRIGGER formulas_set_revision ON formulas;
+DROP TRIGGER formulas_catalogue_bump ON formulas;
+DROP FUNCTION formulas_set_revision();
+DROP FUNCTION catalogue_bump();
+ALTER TABLE formulas DROP COLUMN revision;
+DROP TABLE catalogue;
\ No newline at end of file
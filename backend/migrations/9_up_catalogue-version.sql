@@ -0,0 +1,33 @@
+CREATE TABLE catalogue (
+    version BIGINT NOT NULL
+);
+INSERT INTO catalogue(version) VALUES (0);
+
+ALTER TABLE formulas ADD COLUMN revision BIGINT NOT NULL DEFAULT 0;
+CREATE INDEX formulas_revision_idx ON formulas(revision);
+
+-- Every statement changing formulas bumps the catalogue version. The row lock on `catalogue` is held
+-- until commit, so revisions become visible strictly in order and readers can poll `revision > last`.
+CREATE FUNCTION catalogue_bump() RETURNS trigger AS $$
+BEGIN
+    UPDATE catalogue SET version = version + 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER formulas_catalogue_bump
+    BEFORE INSERT OR UPDATE OR DELETE OR TRUNCATE ON formulas
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION catalogue_bump();
+
+CREATE FUNCTION formulas_set_revision() RETURNS trigger AS $$
+BEGIN
+    NEW.revision := (SELECT version FROM catalogue);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER formulas_set_revision
+    BEFORE INSERT OR UPDATE ON formulas
+    FOR EACH ROW
+    EXECUTE FUNCTION formulas_set_revision();
@@ -0,0 +1,8 @@
+import os
+import sys
+from pathlib import Path
+
+# Tests import the `app` package, whose settings are read from the `.env` file next to it
+BACKEND = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(BACKEND))
+os.chdir(BACKEND)
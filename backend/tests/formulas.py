@@ -0,0 +1,25 @@
+import random
+
+VARIABLES = ["x", "y", "a", "b", "n"]
+
+
+def expression(generator: random.Random, depth: int) -> str:
+    """Generate a random LaTeX expression parseable by `canonical_array`."""
+    if depth == 0 or generator.random() < 0.25:
+        return generator.choice(VARIABLES + [str(generator.randint(1, 9))])
+    left, right = expression(generator, depth - 1), expression(generator, depth - 1)
+    return generator.choice([
+        f"{left} + {right}",
+        f"{left} - {right}",
+        f"{left} \\cdot {right}",
+        f"\\frac{{{left}}}{{{right}}}",
+        f"({left})^{{{generator.randint(2, 3)}}}",
+        f"\\sin({left})",
+        f"\\cos({left}) + {right}",
+        f"\\sqrt{{{left}}}",
+    ])
+
+
+def corpus(size: int, seed: int, depth: int = 3) -> list[str]:
+    generator = random.Random(seed)
+    return [expression(generator, depth) for _ in range(size)]
@@ -0,0 +1,40 @@
+import asyncio
+
+import pytest
+
+from app.cache import ResultCache
+
+
+def test_concurrent_misses_are_computed_once():
+    calls = []
+
+    async def compute():
+        calls.append(None)
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    async def main():
+        cache = ResultCache()
+        return await asyncio.gather(*(cache.get("key", compute) for _ in range(5)))
+
+    assert asyncio.run(main()) == [1] * 5
+    assert len(calls) == 1
+
+
+def test_exceptions_are_passed_on_and_not_cached():
+    calls = []
+
+    async def compute():
+        calls.append(None)
+        await asyncio.sleep(0.01)
+        raise ValueError
+
+    async def main():
+        cache = ResultCache()
+        results = await asyncio.gather(*(cache.get("key", compute) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+        with pytest.raises(ValueError):
+            await cache.get("key", compute)
+
+    asyncio.run(main())
+    assert len(calls) == 2
@@ -0,0 +1,23 @@
+import asyncio
+import time
+
+import pytest
+
+from app.engine import ComparisonEngine, ComparisonTimeout
+
+
+def test_timeout_does_not_cancel_queued_calls():
+    async def main():
+        engine = ComparisonEngine(1)
+        try:
+            await engine.start()
+            slow = asyncio.create_task(engine.run(time.sleep, 5, timeout=1))
+            await asyncio.sleep(0.2)
+            queued = [asyncio.create_task(engine.run(pow, 2, exponent, timeout=60)) for exponent in range(6)]
+            with pytest.raises(ComparisonTimeout):
+                await slow
+            return await asyncio.gather(*queued)
+        finally:
+            engine.close()
+
+    assert asyncio.run(main()) == [2 ** exponent for exponent in range(6)]
@@ -0,0 +1,50 @@
+import itertools
+import random
+
+import pytest
+
+import reference_compare
+from app.compare_functions import find_indexes, find_indexes_prepared, prepare_formula
+
+from formulas import VARIABLES, corpus
+
+
+def rename_variables(latex: str, seed: int) -> str:
+    """Rename variables consistently, so that the formula keeps the same abstracted structure."""
+    generator = random.Random(seed)
+    renamed = dict(zip(VARIABLES, generator.sample(["p", "q", "r", "s", "t"], len(VARIABLES))))
+    return "".join(renamed.get(char, char) for char in latex)
+
+
+def outcome(function, *args):
+    """Result of a call, or the type of the exception it raised."""
+    try:
+        return function(*args)
+    except Exception as e:
+        return type(e)
+
+
+def pairs() -> list[tuple[str, str]]:
+    formulas = corpus(50, seed=5, depth=4)
+    result = list(itertools.product(formulas[:40], repeat=2))
+    result += [(latex, f"{rename_variables(latex, i)} + {latex}") for i, latex in enumerate(formulas)]
+    result += [(f"\\frac{{{a}}}{{{b}}}", f"{b} - {a}") for a, b in zip(formulas, reversed(formulas))]
+    return result
+
+
+PAIRS = pairs()
+
+
+@pytest.mark.parametrize("chunk", range(0, len(PAIRS), 200))
+def test_matches_reference(chunk):
+    for formula1, formula2 in PAIRS[chunk:chunk + 200]:
+        expected = outcome(reference_compare.find_indexes, formula1, formula2)
+        assert outcome(find_indexes, formula1, formula2) == expected, (formula1, formula2)
+
+
+def test_prepared_matches_reference():
+    formulas = corpus(30, seed=7, depth=4)
+    prepared = [prepare_formula(latex) for latex in formulas]
+    for (latex1, prepared1), (latex2, prepared2) in itertools.product(zip(formulas, prepared), repeat=2):
+        expected = outcome(reference_compare.find_indexes, latex1, latex2)
+        assert outcome(find_indexes_prepared, prepared1, prepared2) == expected, (latex1, latex2)
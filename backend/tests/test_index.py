@@ -0,0 +1,102 @@
+import asyncio
+import heapq
+
+import pytest
+
+from app.canonical import canonicalize
+from app.compare_functions import percent_arrays, prepare_formula, tokenize_formula, find_indexes_prepared, find_indexes
+from app.engine import ComparisonEngine
+from app.index import ABSTRACT_NGRAM, CanonicalIndex, FormulaIndex, ngrams
+
+from formulas import corpus
+from test_find_indexes import outcome
+
+K = 5
+
+
+@pytest.fixture(scope="module")
+def catalogue() -> list[dict]:
+    return [
+        {"id": formula_id, "name": "", "latex": latex, "source": "", "description": "", "canonical": canonicalize(latex)}
+        for formula_id, latex in enumerate(corpus(300, seed=2))
+    ]
+
+
+@pytest.fixture(scope="module")
+def index(catalogue) -> CanonicalIndex:
+    index = CanonicalIndex()
+    for row in catalogue:
+        index.add(row["id"], row["canonical"])
+    return index
+
+
+def brute_force(catalogue: list[dict], query: list[str], k: int) -> list[tuple[float, int]]:
+    scores = [(percent_arrays(query, row["canonical"]), row["id"]) for row in catalogue]
+    return heapq.nlargest(k, [score for score in scores if score[0] > 0])
+
+
+def test_single_shared_token_is_found():
+    index = CanonicalIndex()
+    index.add(1, canonicalize(r"\sin(x)"))
+    query = canonicalize(r"\sin(1)")
+    assert percent_arrays(query, canonicalize(r"\sin(x)")) > 0
+    assert [formula_id for _, formula_id in index.top_percent(query, K)] == [1]
+
+
+@pytest.mark.parametrize("latex", corpus(60, seed=3) + [r"\sin(1)", "x", "2"])
+def test_exact_search_matches_brute_force(catalogue, index, latex):
+    query = canonicalize(latex)
+    found = [score for score in index.top_percent(query, K) if score[0] > 0]
+    assert found == brute_force(catalogue, query, K)
+
+
+def test_shards_match_unsharded_search(index):
+    for latex in corpus(20, seed=4):
+        query = canonicalize(latex)
+        shards = [score for shard in range(3) for score in index.top_percent(query, K, shard, 3)]
+        assert heapq.nlargest(K, shards) == index.top_percent(query, K)
+
+
+def test_duplicates_match_brute_force(catalogue, index):
+    threshold = 80
+    expected = {
+        (row["id"], other["id"], percent_arrays(row["canonical"], other["canonical"]))
+        for row in catalogue for other in catalogue
+        if row["id"] < other["id"] and percent_arrays(row["canonical"], other["canonical"]) >= threshold
+    }
+    found = [pair for shard in range(3) for pair in index.duplicates(threshold, shard, 3)]
+    assert len(found) == len(expected)
+    assert set(found) == expected
+
+
+def test_rows_exclude_canonical(catalogue):
+    index = FormulaIndex()
+    index.add(dict(catalogue[0]))
+    assert index.formulas[0] == {key: catalogue[0][key] for key in ("id", "name", "latex", "source", "description")}
+
+
+def test_engine_tokenized_formulas_match_queries(catalogue):
+    # Force tokens to be interned in a different order than the engine processes see them
+    prepare_formula(r"\zeta + \omega \cdot \Gamma")
+
+    async def indexed() -> FormulaIndex:
+        engine = ComparisonEngine(2, chunk_size=16)
+        try:
+            index = FormulaIndex(batch_size=50, engine=engine)
+            await index.add_many([dict(row) for row in catalogue[:100]])
+            return index
+        finally:
+            engine.close()
+
+    index = asyncio.run(indexed())
+    for latex in corpus(20, seed=6, depth=4):
+        query = prepare_formula(latex)
+        tokens = tokenize_formula(latex)[0]
+        expected = {
+            row["id"] for row in catalogue[:100]
+            if ngrams(tokenize_formula(row["latex"])[0], ABSTRACT_NGRAM) & ngrams(tokens, ABSTRACT_NGRAM)
+        }
+        assert index.abstract_candidates(query) == expected
+        for row in catalogue[:100]:
+            prepared = outcome(find_indexes_prepared, index.prepared[row["id"]], query)
+            assert prepared == outcome(find_indexes, row["latex"], latex)
@@ -0,0 +1,60 @@
+import threading
+
+import pytest
+
+from app import replica
+from app.canonical import canonicalize
+from app.index import CanonicalIndex
+from app.lsh import MinHashLSH
+
+from formulas import corpus
+
+K = 5
+
+
+@pytest.fixture(scope="module")
+def rows() -> list[tuple]:
+    return [(formula_id, canonicalize(latex), formula_id) for formula_id, latex in enumerate(corpus(60, seed=8))]
+
+
+def test_snapshot_restores_search(rows):
+    index = CanonicalIndex()
+    for formula_id, canonical, _ in rows:
+        index.add(formula_id, canonical)
+    restored = CanonicalIndex()
+    assert restored.restore(index.snapshot())
+    for _, query, _ in rows[:10]:
+        assert restored.top_percent(query, K) == index.top_percent(query, K)
+        assert restored.approximate_percent(query, K) == index.approximate_percent(query, K)
+    assert not CanonicalIndex(MinHashLSH(8, 8)).restore(index.snapshot())
+
+
+def test_searches_report_loading_and_restarts_use_snapshot(rows, tmp_path, monkeypatch):
+    rows = list(rows)
+    loading = threading.Event()
+    fetched = []
+
+    def fetch(limit=None):
+        loading.wait()
+        fetched.append(replica._index.revision)
+        changed = [row for row in rows if row[2] > replica._index.revision]
+        # The catalogue version is the revision of the newest row
+        return len(rows), changed[:limit] if limit else changed
+
+    monkeypatch.setattr(replica, "_fetch", fetch)
+    snapshot = str(tmp_path / "canonical-index.pickle")
+    query = rows[0][1]
+
+    replica.configure("postgresql://", 16, 4, 2, snapshot)
+    with pytest.raises(replica.ReplicaNotReady):
+        replica.top_percent_shard(0, 1, 0, [query], K)
+    loading.set()
+    replica._loader.join()
+    assert replica.top_percent_shard(0, 1, 0, [query], K)[0]
+
+    # A process started later restores the snapshot and only fetches formulas changed since
+    rows.append((len(rows), query, len(rows)))
+    replica.configure("postgresql://", 16, 4, 2, snapshot)
+    replica._loader.join()
+    assert fetched == [-1, len(rows) - 2]
+    assert (100.0, len(rows) - 1) in replica.top_percent_shard(0, 1, len(rows), [query], K)[0]
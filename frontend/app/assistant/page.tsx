@@ -36,7 +36,7 @@ export default function Chat() {
         try {
             const controller = new AbortController()
             const timeoutId = setTimeout(() => controller.abort(), 100000000000000000)
-            const response = await fetch(`/api/message`, {
+            const response = await fetch(`/api/message/stream`, {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
@@ -45,13 +45,29 @@ export default function Chat() {
                 signal: controller.signal
             })
 
-            if (!response.ok) {
+            if (!response.ok || !response.body) {
                 throw new Error('Не удалось получить ответ')
             }
 
-            const data = await response.json()
-            const assistantMessage: Message = {role: 'assistant', content: data}
-            setMessages(prev => [...prev, assistantMessage])
+            // Ответ приходит в виде server-sent events, дописываем его в последнее сообщение по мере генерации
+            setMessages(prev => [...prev, {role: 'assistant', content: ''}])
+            const reader = response.body.pipeThrough(new TextDecoderStream()).getReader()
+            let buffer = ''
+            while (true) {
+                const {value, done} = await reader.read()
+                if (done) break
+                buffer += value
+                const events = buffer.split('\n\n')
+                buffer = events.pop() ?? ''
+                for (const event of events) {
+                    if (!event.startsWith('data: ')) continue
+                    const {content} = JSON.parse(event.slice(6))
+                    setMessages(prev => [
+                        ...prev.slice(0, -1),
+                        {role: 'assistant', content: prev[prev.length - 1].content + content}
+                    ])
+                }
+            }
         } catch (error) {
             console.error('Ошибка:', error)
             // Можно добавить обработку ошибок, например, показать уведомление пользователю
@@ -3,17 +3,13 @@
 import {useParams} from 'next/navigation'
 import Link from 'next/link'
 import {useEffect} from 'react'
-import {useFormulas} from "@/lib/api";
+import {useFormula} from "@/lib/api";
 import {QueryClient, QueryClientProvider} from "@tanstack/react-query";
 
 function Formula() {
-    let {data: formulas} = useFormulas()
     const params = useParams()
     const id = Number(params.id)
-    if (formulas == null) {
-        formulas = []
-    }
-    const formula = formulas.find(f => f.id === id)
+    const {data: formula} = useFormula(id)
 
     useEffect(() => {
         const loadMathJax = async () => {
@@ -15,15 +15,17 @@ import { Badge } from "@/components/ui/badge"
 import { Play, XCircle, Archive } from 'lucide-react'
 import {useMutation, useQueryClient} from "@tanstack/react-query";
 
-type JobStatus = "pnd" | "prc" | "suc" | "err"
+type JobStatus = "pnd" | "prc" | "suc" | "err" | "arc"
 
 export interface Job {
   id: number
   status: JobStatus
   datetime: string
+  pages_done: number | null
+  pages_total: number | null
 }
 
-function nameFromShorthand(s: "pnd" | "prc" | "suc" | "err"): string {
+function nameFromShorthand(s: JobStatus): string {
   switch (s) {
     case "pnd":
       return "Ожидание очереди"
@@ -66,6 +68,7 @@ export function JobsTable({jobs}: {jobs: Job[]}) {
       case "prc":
         return "default"
       case "pnd":
+      case "arc":
         return "secondary"
       case "err":
         return "destructive"
@@ -99,6 +102,9 @@ export function JobsTable({jobs}: {jobs: Job[]}) {
                 <Badge variant={getStatusColor(job.status)}>
                   {nameFromShorthand(job.status)}
                 </Badge>
+                {job.status === "prc" && job.pages_total !== null && (
+                  <span className="ml-2 text-sm text-muted-foreground">{job.pages_done}/{job.pages_total}</span>
+                )}
               </TableCell>
               <TableCell>{(new Date(job.datetime)).toLocaleString()}</TableCell>
               <TableCell>
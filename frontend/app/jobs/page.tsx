@@ -1,15 +1,33 @@
 "use client";
 import { Job, JobsTable } from "./jobs-table"
-import { QueryClient, QueryClientProvider, useQuery } from "@tanstack/react-query";
+import { QueryClient, QueryClientProvider, useQuery, useQueryClient } from "@tanstack/react-query";
+import { useEffect } from "react";
+import { Page } from "@/lib/api";
 
 function JobsPage() {
     let { data, isLoading, isError } = useQuery({
         queryFn: async () => {
-            let res = await fetch('/api/jobs');
-            return await res.json() as Job[];
+            // Newest jobs first, so that the first page shows recent jobs on a busy install
+            let res = await fetch('/api/jobs?order=desc');
+            return (await res.json() as Page<Job>).items;
         },
         queryKey: ["jobs"]
     })
+    const client = useQueryClient();
+    // Changes of jobs are pushed by the backend, so the list is fetched only once
+    useEffect(() => {
+        const events = new EventSource('/api/jobs/events');
+        events.onmessage = (event) => {
+            const job = JSON.parse(event.data) as Job;
+            client.setQueryData<Job[]>(["jobs"], (jobs) => {
+                if (jobs === undefined)
+                    return jobs;
+                const rest = jobs.filter((j) => j.id !== job.id);
+                return job.status === "arc" ? rest : [...rest, job].sort((a, b) => b.id - a.id);
+            });
+        };
+        return () => events.close();
+    }, [client]);
     if (isLoading || isError)
         return null
     return (
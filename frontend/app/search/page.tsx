@@ -4,7 +4,7 @@ import * as React from 'react';
 // @ts-ignore
 import style from '@edtr-io/mathquill/build/mathquill.css';
 import Link from 'next/link'
-import {Formula, useFormulas} from "@/lib/api";
+import {Formula, useSearchFormulas} from "@/lib/api";
 import {QueryClient, QueryClientProvider, useQuery} from "@tanstack/react-query";
 
 const EquationEditor = dynamic(() => import('@/components/EquationEditor'), {ssr: false});
@@ -78,7 +78,8 @@ function Search() {
         },
         enabled: deep
     })
-    const {data: formulas, isLoading, isError} = useFormulas();
+    // Without deep search the backend matches the LaTeX against the whole catalogue by similarity
+    const {data: latexMatches} = useSearchFormulas(deep ? "" : searchTerm, "latex");
     const [filteredFormulas, setFilteredFormulas] = useState<Formula[]>([]);
     const [show, setShow] = useState(false);
 
@@ -89,13 +90,11 @@ function Search() {
     }, [])
     useEffect(() => {
         let forms;
-        if (formulasIndexes == null)
-            return;
         if (!deep)
-            forms = (formulas ? formulas : []).filter((formula: any) =>
-                formula.latex.toLowerCase().replace(" ", "").includes(searchTerm.toLowerCase().replace(" ", ""))
-            );
+            forms = latexMatches ?? [];
         else {
+            if (formulasIndexes == null)
+                return;
             console.log(formulasIndexes)
             if (formulasIndexes != null)
                 forms = formulasIndexes.filter((x: any) => (x.indexes as number[]).length != 0).map((x: { formula: any, indexes: any }) => ({
@@ -107,7 +106,7 @@ function Search() {
             else forms = []
         }
         setFilteredFormulas(forms)
-    }, [searchTerm, formulas, formulasIndexes])
+    }, [deep, latexMatches, formulasIndexes])
     const handleMathQuillChange = (mathField: any) => {
         setSearchTerm(mathField.latex());
     };
@@ -3,19 +3,11 @@
 import { useState } from 'react'
 import { Search } from 'lucide-react'
 import Link from 'next/link'
-
-const formulas = [
-  { id: 1, name: 'Pythagorean Theorem', latex: 'a^2 + b^2 = c^2', source: 'https://en.wikipedia.org/wiki/Pythagorean_theorem' },
-  { id: 2, name: 'Quadratic Formula', latex: 'x = \\frac{-b \\pm \\sqrt{b^2 - 4ac}}{2a}', source: 'https://en.wikipedia.org/wiki/Quadratic_formula' },
-  { id: 3, name: 'Euler\'s Identity', latex: 'e^{i\\pi} + 1 = 0', source: 'https://en.wikipedia.org/wiki/Euler%27s_identity' },
-]
+import { useSearchFormulas } from '@/lib/api'
 
 export default function FormulaSearch() {
   const [searchTerm, setSearchTerm] = useState('')
-
-  const filteredFormulas = formulas.filter(formula =>
-    formula.name.toLowerCase().includes(searchTerm.toLowerCase())
-  )
+  const { data: filteredFormulas = [] } = useSearchFormulas(searchTerm)
 
   return (
     <div className="border rounded-lg p-4 bg-white shadow-md">
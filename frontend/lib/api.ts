@@ -9,15 +9,42 @@ export interface Formula {
     indexes?: number[];
 }
 
+export interface Page<T> {
+    items: T[];
+    next: number | null;
+}
+
 export function useFormulas() {
     return useQuery({
         queryFn: async () => {
-            return (await (await fetch("/api/formulas")).json()) as Formula[]
+            return ((await (await fetch("/api/formulas")).json()) as Page<Formula>).items
         },
         queryKey: ["formulas"]
     })
 }
 
+export function useFormula(id: number) {
+    return useQuery({
+        queryFn: async () => {
+            const response = await fetch(`/api/formulas/${id}`)
+            return response.ok ? (await response.json()) as Formula : null
+        },
+        queryKey: ["formulas", id]
+    })
+}
+
+// Searches names and descriptions with `q`, or stored LaTeX by similarity with `latex`
+export function useSearchFormulas(query: string, by: "q" | "latex" = "q") {
+    return useQuery({
+        queryFn: async () => {
+            const params = new URLSearchParams({[by]: query})
+            return ((await (await fetch(`/api/formulas/search?${params}`)).json()) as Page<Formula>).items
+        },
+        queryKey: ["formulas", "search", by, query],
+        enabled: query.trim().length > 0
+    })
+}
+
 export function useCreateFormula() {
     const client = useQueryClient();
     return useMutation({
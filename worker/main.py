@@ -1,108 +1,560 @@
+import functools
+import hashlib
+import importlib.metadata
+import json
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+import multiprocessing
+import multiprocessing.connection
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait
+from concurrent.futures.process import BrokenProcessPool
 from io import BytesIO
 
+import numpy as np
 import pika
 import os
-import tempfile
+
+# Consumers run in separate processes and share metrics through files, see `prometheus_client.multiprocess`
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", tempfile.mkdtemp(prefix="worker-metrics-"))
+
+import torch
+import httpx
 import ollama
 import psycopg
+import pypdfium2
+from psycopg_pool import ConnectionPool
 import re
-from psycopg.rows import dict_row
 from marker.converters.pdf import PdfConverter
 from marker.models import create_model_dict
 from marker.output import text_from_rendered
 from PIL import Image
 from pix2tex.cli import LatexOCR
+from pix2tex.dataset.transforms import test_transform
+from pix2tex.utils import pad, minmax_size, token2str, post_process
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, multiprocess, start_http_server
 
-print("Please, wait! Models are now loading (it will load models from hf.co on the first startup, next loadings will be much faster since they will be loaded from disk.")
-converter = PdfConverter(
-    artifact_dict=create_model_dict(),
-)
-model = LatexOCR()
-print("Done loading models!")
+# Loaded once in `main` and shared with the forked consumers
+model: LatexOCR | None = None
+pdf_models: dict | None = None
+pdf_executor: ProcessPoolExecutor | None = None
 
 AMQP_DSN = os.getenv("AMQP_DSN")
 AI_PDF_QUEUE = os.getenv("AI_PDF_QUEUE")
 AI_LATEX_OCR_QUEUE = os.getenv("AI_LATEX_OCR_QUEUE")
 POSTGRES_DSN = os.getenv("POSTGRES_DSN")
+# Maximal amount of database connections of every consumer process
+POSTGRES_POOL_SIZE = int(os.getenv("POSTGRES_POOL_SIZE", "4"))
 OLLAMA_URL = os.getenv("OLLAMA_URL")
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL")
+# Identifier of the models importing PDFs, results of identical uploads are reused only while it stays the same
+PDF_PIPELINE = f"marker-{importlib.metadata.version('marker-pdf')}/{OLLAMA_MODEL}"
+# Identifier of the screenshot model, results of identical screenshots are reused only while it stays the same
+OCR_MODEL = f"pix2tex-{importlib.metadata.version('pix2tex')}"
+# Maximal amount of screenshots recognized at once and milliseconds to wait for a batch to fill up
+OCR_BATCH_SIZE = int(os.getenv("OCR_BATCH_SIZE", "16"))
+OCR_BATCH_WAIT = int(os.getenv("OCR_BATCH_WAIT", "50"))
+# Amount of consumer processes per queue, a long PDF never delays screenshots
+OCR_CONSUMERS = int(os.getenv("OCR_CONSUMERS", "1"))
+PDF_CONSUMERS = int(os.getenv("PDF_CONSUMERS", "1"))
+# Amount of processes converting pages of a PDF for every PDF consumer, all cores by default
+PDF_PROCESSES = int(os.getenv("PDF_PROCESSES", str(os.cpu_count() or 1)))
+# Amount of pages converted by a process at once, progress of a job is updated after each range
+PDF_PAGES_PER_RANGE = int(os.getenv("PDF_PAGES_PER_RANGE", "8"))
+# Amount of formulas annotated by the LLM at once, Ollama has to be allowed to serve as many parallel requests
+OLLAMA_CONCURRENCY = int(os.getenv("OLLAMA_CONCURRENCY", "4"))
+METRICS_PORT = int(os.getenv("METRICS_PORT", "8001"))
 
+# Normalized value of a white pixel, used to pad images of a batch to the same size
+WHITE = (1 - 0.7931) / 0.1738
 
-client = ollama.Client(OLLAMA_URL)
+OCR_BATCH_SIZES = Histogram(
+    "ocr_batch_size",
+    "Amount of screenshots recognized in one batch",
+    buckets=[1, 2, 4, 8, 16, 32, 64],
+)
+OCR_BATCH_LATENCY = Histogram(
+    "ocr_batch_duration_seconds",
+    "Time spent recognizing one batch of screenshots",
+)
+OCR_RESULT_CACHE_HITS = Counter(
+    "worker_ocr_result_cache_hits_total",
+    "Total number of screenshots answered from results of identical earlier screenshots",
+)
+OCR_RESULT_CACHE_MISSES = Counter(
+    "worker_ocr_result_cache_misses_total",
+    "Total number of screenshots recognized",
+)
+PDF_RESULT_CACHE_HITS = Counter(
+    "worker_pdf_result_cache_hits_total",
+    "Total number of PDFs answered from results of identical earlier uploads",
+)
+PDF_RESULT_CACHE_MISSES = Counter(
+    "worker_pdf_result_cache_misses_total",
+    "Total number of PDFs imported",
+)
+DB_POOL_WAIT = Histogram(
+    "worker_db_pool_wait_seconds",
+    "Time spent waiting for a database connection from the pool",
+)
+DB_POOL_IN_USE = Gauge(
+    "worker_db_pool_connections_in_use",
+    "Amount of database connections currently borrowed from the pools",
+    multiprocess_mode="livesum",
+)
+
+
+annotation_executor = ThreadPoolExecutor(OLLAMA_CONCURRENCY)
+
+ANNOTATION_FORMAT = {
+    "type": "object",
+    "properties": {
+        "name": {"type": "string"},
+        "description": {"type": "string"},
+    },
+    "required": ["name", "description"],
+}
 
 def connect_to_rabbitmq():
     connection = pika.BlockingConnection(pika.URLParameters(AMQP_DSN))
     channel = connection.channel()
-    channel.queue_declare(queue=AI_PDF_QUEUE)
     return connection, channel
 
-def connect_to_database() -> psycopg.Connection:
-    return psycopg.connect(POSTGRES_DSN)
+def declare_queue(channel: pika.adapters.blocking_connection.BlockingChannel, queue: str):
+    """Declare a queue whose rejected messages are moved to `<queue>.dead`, the backend declares it the same way."""
+    channel.queue_declare(queue=f"{queue}.dead")
+    channel.queue_declare(queue=queue, arguments={
+        "x-dead-letter-exchange": "",
+        "x-dead-letter-routing-key": f"{queue}.dead",
+    })
+
+# Created on first use, so that every consumer process gets its own pool after the fork
+db_pool: ConnectionPool | None = None
+db_pool_lock = threading.Lock()
+
+@contextmanager
+def database():
+    """Borrow a connection from the pool of the process, it is committed when returned."""
+    global db_pool
+    with db_pool_lock:
+        if db_pool is None:
+            db_pool = ConnectionPool(
+                POSTGRES_DSN,
+                min_size=1,
+                max_size=POSTGRES_POOL_SIZE,
+                check=ConnectionPool.check_connection,
+            )
+    start = time.perf_counter()
+    with db_pool.connection() as db:
+        DB_POOL_WAIT.observe(time.perf_counter() - start)
+        DB_POOL_IN_USE.inc()
+        try:
+            yield db
+        finally:
+            DB_POOL_IN_USE.dec()
+
+# Created on first use, so that every consumer process gets its own connections to Ollama after the fork
+ollama_client: ollama.Client | None = None
+ollama_client_lock = threading.Lock()
+
+def llm() -> ollama.Client:
+    """Ollama client of the process, it is shared by its annotation threads."""
+    global ollama_client
+    with ollama_client_lock:
+        if ollama_client is None:
+            ollama_client = ollama.Client(OLLAMA_URL)
+    return ollama_client
+
+def pull_model():
+    """Download the LLM in the supervisor, over a connection closed right away so that no consumer inherits it."""
+    ollama.Client(OLLAMA_URL, limits=httpx.Limits(max_keepalive_connections=0)).pull(OLLAMA_MODEL)
+
+def annotate(formula: str, context: str) -> tuple[str, str]:
+    """Ask the LLM for a name of the formula and descriptions of its variables in one request."""
+    response: ollama.ChatResponse = llm().chat(model=OLLAMA_MODEL, format=ANNOTATION_FORMAT, messages=[
+        {
+            'role': 'user',
+            'content': f'Give a name for formula "{formula}" and describe all variables in it. For reference use the following context: "{context}". Answer with JSON, put only the name into "name" and only descriptions of variables, separated by new line, into "description".',
+        },
+    ])
+    try:
+        annotation = json.loads(response.message.content)
+        return str(annotation["name"]), str(annotation["description"])
+    except (ValueError, KeyError, TypeError):
+        return "", str(response.message.content)
+
+
+def save_import(db: psycopg.Connection, job_id: int, message: dict, formulas: list[tuple[str, str, str]]):
+    """
+    Store extracted formulas and the results of the job, and mark the job as succeeded, in a single transaction.
+
+    Formula ids are reserved beforehand, so that formulas and result entries can be written with COPY.
+
+    :param formulas: List of (name, latex, description) triples
+    """
+    with db.transaction():
+        cur = db.cursor()
+        cur.execute(
+            "SELECT nextval(pg_get_serial_sequence('formulas', 'id')) FROM generate_series(1, %s)",
+            (len(formulas),),
+        )
+        ids = [row[0] for row in cur.fetchall()]
+        with cur.copy("COPY formulas (id, name, latex, source, description) FROM STDIN") as copy:
+            for formula_id, (name, latex, description) in zip(ids, formulas):
+                copy.write_row((formula_id, name, latex, "", description))
+        # Hash and pipeline let later imports reuse these results for identical uploads, see `reuse_import`
+        cur.execute(
+            "INSERT INTO import_results(job_id, sha256, pipeline) VALUES (%s, %s, %s) RETURNING id",
+            (job_id, message["sha256"], PDF_PIPELINE),
+        )
+        results_id = cur.fetchone()[0]
+        with cur.copy("COPY import_results_entries (result_id, formula_id) FROM STDIN") as copy:
+            for formula_id in ids:
+                copy.write_row((results_id, formula_id))
+        cur.execute("UPDATE jobs SET status='suc' WHERE id=%s", (job_id,))
+
+
+def reuse_import(db: psycopg.Connection, job_id: int, message: dict) -> bool:
+    """
+    Link the formulas of an earlier import of the same document by the same pipeline to the job,
+    and mark the job as succeeded, in a single transaction.
+
+    :return: Whether such an import was found
+    """
+    with db.transaction():
+        cur = db.cursor()
+        cur.execute(
+            "SELECT id FROM import_results WHERE sha256 = %s AND pipeline = %s ORDER BY id DESC LIMIT 1",
+            (message["sha256"], PDF_PIPELINE),
+        )
+        cached = cur.fetchone()
+        if cached is None:
+            return False
+        cur.execute(
+            "INSERT INTO import_results(job_id, sha256, pipeline) VALUES (%s, %s, %s) RETURNING id",
+            (job_id, message["sha256"], PDF_PIPELINE),
+        )
+        results_id = cur.fetchone()[0]
+        cur.execute(
+            "INSERT INTO import_results_entries(result_id, formula_id) "
+            "SELECT %s, formula_id FROM import_results_entries WHERE result_id = %s",
+            (results_id, cached[0]),
+        )
+        cur.execute("UPDATE jobs SET status='suc' WHERE id=%s", (job_id,))
+    return True
+
+
+def load_pdf_models():
+    global pdf_models
+    pdf_models = create_model_dict()
+
+
+def create_pdf_executor() -> ProcessPoolExecutor:
+    # Conversion processes are forked from a PDF consumer, which never runs the models itself,
+    # so they share the models loaded by the supervisor
+    executor = ProcessPoolExecutor(PDF_PROCESSES, mp_context=multiprocessing.get_context("fork"))
+    # Fork all processes right away, before the consumer opens its connections
+    wait([executor.submit(os.getpid) for _ in range(PDF_PROCESSES)])
+    return executor
 
-def process_pdf(_ch, _method, properties, body):
-    db = connect_to_database()
-    ids = []
-    db.execute("UPDATE jobs SET status='prc' WHERE id=%s", (int(properties.correlation_id),))
-    db.commit()
-    # Save PDF content to a temporary file
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_pdf:
-        temp_pdf.write(body)
-        temp_pdf_path = temp_pdf.name
 
+def convert_pages(pdf_path: str, pages: list[int]) -> str:
+    """Convert a range of pages of a PDF to markdown in a conversion process."""
+    converter = PdfConverter(artifact_dict=pdf_models, config={"page_range": pages})
+    text, _, _ = text_from_rendered(converter(pdf_path))
+    return text
+
+
+def extract_formulas(text: str) -> list[tuple[str, str]]:
+    """Find display formulas in converted markdown together with up to 1000 characters of context around them."""
+    formulas = []
+    for match in re.finditer(r"\$\$[^\$]*\$\$", text):
+        formula = match.group()
+        formula = formula.strip("$")
+        context_span = max(0, match.span()[0]-1000), min(len(text), match.span()[1]+1000)
+        formulas.append((formula, text[context_span[0]:context_span[1]]))
+    return formulas
+
+
+def process_pdf(connection: pika.BlockingConnection, ch: pika.adapters.blocking_connection.BlockingChannel, method, properties, body):
+    """
+    Import formulas from a PDF. Runs in a separate thread, so that the consumer keeps serving heartbeats,
+    and acknowledges the message through the connection thread once the results are committed.
+    Failed messages are rejected into the dead letter queue and keep their spooled file for a retry.
+    """
+    global pdf_executor
+    job_id = None
+    conversions = {}
+    succeeded = False
     try:
-        rendered = converter(temp_pdf_path)
-        text, _, _ = text_from_rendered(rendered)
-        for match in re.finditer(r"\$\$[^\$]*\$\$", text):
-            cur = db.cursor(row_factory=dict_row)
-            formula = match.group()
-            formula = formula.strip("$")
-            context_span = max(0, match.span()[0]-1000), min(len(text), match.span()[1]+1000)
-            context = text[context_span[0]:context_span[1]]
-            response: ollama.ChatResponse = ollama.chat(model='llama3.2', messages=[
-                {
-                    'role': 'user',
-                    'content': f'Describe all variables in formula "{formula}". For reference use the following context: "{context}". Do not include any other text. Write only descriptions of variables, separated by new line.',
-                },
-            ])
-            name: ollama.ChatResponse = ollama.chat(model='llama3.2', messages=[
-                {
-                    'role': 'user',
-                    'content': f'Give a name for formula "{formula}". For reference use the following context: "{context}". Do not include any other text. Write only name.',
-                },
-            ])
-            cur.execute("INSERT INTO formulas(name, latex, source, description) VALUES (%s, %s, %s, %s) RETURNING id", (name.message.content, formula, "", str(response.message.content)))
-            ids.append(cur.fetchone()["id"])
-            db.commit()
-        cur = db.cursor(row_factory=dict_row)
-        cur.execute("INSERT INTO import_results(job_id) VALUES (%s) RETURNING id", (int(properties.correlation_id),))
-        results_id = cur.fetchone()["id"]
-        for idx in ids:
-            cur.execute("INSERT INTO import_results_entries(result_id, formula_id) VALUES (%s, %s)", (int(results_id), idx))
-        db.execute("UPDATE jobs SET status='suc' WHERE id=%s", (int(properties.correlation_id),))
-        db.commit()
+        job_id = int(properties.correlation_id)
+        with database() as db:
+            db.execute("UPDATE jobs SET status='prc' WHERE id=%s", (job_id,))
+        # The backend spools the uploaded PDF to the shared directory and only sends its location
+        message = json.loads(body)
+        pdf_path = message["path"]
+        with database() as db:
+            reused = reuse_import(db, job_id, message)
+        if reused:
+            PDF_RESULT_CACHE_HITS.inc()
+        else:
+            PDF_RESULT_CACHE_MISSES.inc()
+            document = pypdfium2.PdfDocument(pdf_path)
+            page_count = len(document)
+            document.close()
+            ranges = [
+                list(range(start, min(start + PDF_PAGES_PER_RANGE, page_count)))
+                for start in range(0, page_count, PDF_PAGES_PER_RANGE)
+            ]
+            with database() as db:
+                db.execute("UPDATE jobs SET pages_done=0, pages_total=%s WHERE id=%s", (page_count, job_id))
+            conversions = {pdf_executor.submit(convert_pages, pdf_path, pages): index for index, pages in enumerate(ranges)}
+            # Formulas of a range are annotated as soon as it is converted, while other ranges are still converting
+            annotations: list[list] = [[] for _ in ranges]
+            for conversion in as_completed(conversions):
+                index = conversions[conversion]
+                for formula, context in extract_formulas(conversion.result()):
+                    annotations[index].append((formula, annotation_executor.submit(annotate, formula, context)))
+                with database() as db:
+                    db.execute("UPDATE jobs SET pages_done = pages_done + %s WHERE id=%s", (len(ranges[index]), job_id))
+            formulas = []
+            for annotated in annotations:
+                for formula, annotation in annotated:
+                    name, description = annotation.result()
+                    formulas.append((name, formula, description))
+            with database() as db:
+                save_import(db, job_id, message, formulas)
+        succeeded = True
     except Exception as e:
-        db.execute("UPDATE jobs SET status='err' WHERE id=%s", (int(properties.correlation_id),))
-        db.commit()
         print(f"Error processing PDF: {str(e)}")
+        for conversion in conversions:
+            conversion.cancel()
+        if isinstance(e, BrokenProcessPool):
+            pdf_executor = create_pdf_executor()
+        # The message is rejected even when the job can not be marked as failed
+        if job_id is not None:
+            try:
+                with database() as db:
+                    db.execute("UPDATE jobs SET status='err' WHERE id=%s", (job_id,))
+            except Exception as e:
+                print(f"Error marking job {job_id} as failed: {str(e)}")
     finally:
-        db.close()
-        os.unlink(temp_pdf_path)
+        # Exactly one of both is scheduled, whatever failed above, so the message never stays unacknowledged
+        if succeeded:
+            connection.add_callback_threadsafe(functools.partial(ch.basic_ack, method.delivery_tag))
+        else:
+            connection.add_callback_threadsafe(functools.partial(ch.basic_nack, method.delivery_tag, requeue=False))
+    if succeeded:
+        try:
+            os.unlink(pdf_path)
+        except OSError as e:
+            print(f"Error removing spooled PDF {pdf_path}: {str(e)}")
+
+
+def consume_pdfs():
+    global pdf_executor
+    pdf_executor = create_pdf_executor()
+    connection, channel = connect_to_rabbitmq()
+    declare_queue(channel, AI_PDF_QUEUE)
+    # A consumer works on a single document at a time, others stay in the queue for idle consumers
+    channel.basic_qos(prefetch_count=1)
+
+    def on_message(ch, method, properties, body):
+        threading.Thread(target=process_pdf, args=(connection, ch, method, properties, body)).start()
+
+    channel.basic_consume(queue=AI_PDF_QUEUE, on_message_callback=on_message)
+    channel.start_consuming()
+
+
+def prepare_image(img: Image.Image) -> torch.Tensor:
+    """Preprocess a screenshot the same way `LatexOCR.__call__` does, including the resizing model."""
+    img = minmax_size(pad(img), model.args.max_dimensions, model.args.min_dimensions)
+    input_image = img.convert('RGB').copy()
+    r, w, h = 1, input_image.size[0], input_image.size[1]
+    for _ in range(10):
+        h = int(h * r)
+        img = pad(minmax_size(input_image.resize((w, h), Image.Resampling.BILINEAR if r > 1 else Image.Resampling.LANCZOS), model.args.max_dimensions, model.args.min_dimensions))
+        t = test_transform(image=np.array(img.convert('RGB')))['image'][:1].unsqueeze(0)
+        w = (model.image_resizer(t.to(model.args.device)).argmax(-1).item() + 1) * 32
+        if w == img.size[0]:
+            break
+        r = w / img.size[0]
+    return t
+
+
+def recognize(images: list[Image.Image]) -> list[str]:
+    """Recognize several screenshots with one pass of the model."""
+    with torch.no_grad():
+        tensors = [prepare_image(img) for img in images]
+        height = max(t.shape[2] for t in tensors)
+        width = max(t.shape[3] for t in tensors)
+        batch = torch.cat([
+            torch.nn.functional.pad(t, (0, width - t.shape[3], 0, height - t.shape[2]), value=WHITE)
+            for t in tensors
+        ]).to(model.args.device)
+        dec = model.model.generate(batch, temperature=model.args.get('temperature', .25))
+    results = []
+    for tokens in dec:
+        # Generation runs until every sequence of the batch is finished, drop what follows the end of each one
+        end = (tokens == model.args.eos_token).nonzero()
+        if len(end):
+            tokens = tokens[:end[0].item()]
+        results.append(post_process(token2str(tokens, model.tokenizer)[0]))
+    return results
+
+
+def reply(ch: pika.adapters.blocking_connection.BlockingChannel, properties: pika.BasicProperties, latex: str = "",
+          error: str | None = None):
+    """Answer a screenshot with its LaTeX, or with the reason it was not recognized ("unreadable" or "failed")."""
+    headers = {"model": OCR_MODEL}
+    if error is not None:
+        headers["error"] = error
+    ch.basic_publish(
+        exchange='',
+        routing_key=properties.reply_to,
+        properties=pika.BasicProperties(correlation_id=properties.correlation_id, headers=headers),
+        body=latex.encode("utf-8"),
+    )
+
 
+def reject(ch: pika.adapters.blocking_connection.BlockingChannel, method, properties: pika.BasicProperties, error: str):
+    """Answer the caller right away instead of letting it time out, and move the screenshot to the dead letter queue."""
+    reply(ch, properties, error=error)
+    ch.basic_nack(method.delivery_tag, requeue=False)
+
+
+def recognize_each(images: list[Image.Image]) -> list[str | None]:
+    """
+    Recognize screenshots of a batch, one by one if the batch fails, so that a single bad screenshot
+    does not fail the others.
+
+    :return: LaTeX of every screenshot, None for screenshots that failed
+    """
+    try:
+        with OCR_BATCH_LATENCY.time():
+            return recognize(images)
+    except Exception as e:
+        print(f"Error recognizing screenshots: {str(e)}")
+    if len(images) == 1:
+        return [None]
+    results = []
+    for image in images:
+        try:
+            results.append(recognize([image])[0])
+        except Exception as e:
+            print(f"Error recognizing screenshot: {str(e)}")
+            results.append(None)
+    return results
+
+
+def process_images(ch: pika.adapters.blocking_connection.BlockingChannel, messages: list):
+    """
+    Answer a batch of screenshots. Screenshots recognized earlier by the same model are answered from `ocr_cache`,
+    the others are recognized in one pass and stored there. Callers of screenshots that could not be read or
+    recognized are answered with an error, see `reply`.
+    """
+    hashes = [hashlib.sha256(body).hexdigest() for _, _, body in messages]
+    with database() as db:
+        cached = dict(db.execute(
+            "SELECT sha256, latex FROM ocr_cache WHERE sha256 = ANY(%s) AND model = %s",
+            (hashes, OCR_MODEL),
+        ).fetchall())
+    images, accepted = [], []
+    for (method, properties, body), sha256 in zip(messages, hashes):
+        if sha256 in cached:
+            OCR_RESULT_CACHE_HITS.inc()
+            reply(ch, properties, cached[sha256])
+            ch.basic_ack(method.delivery_tag)
+            continue
+        try:
+            images.append(Image.open(BytesIO(body)))
+            accepted.append((method, properties, sha256))
+        except Exception as e:
+            print(f"Error reading screenshot: {str(e)}")
+            reject(ch, method, properties, "unreadable")
+    if not images:
+        return
+    OCR_RESULT_CACHE_MISSES.inc(len(images))
+    OCR_BATCH_SIZES.observe(len(images))
+    results = recognize_each(images)
+    recognized = [(sha256, OCR_MODEL, latex) for (_, _, sha256), latex in zip(accepted, results) if latex is not None]
+    if recognized:
+        with database() as db:
+            db.cursor().executemany(
+                "INSERT INTO ocr_cache(sha256, model, latex) VALUES (%s, %s, %s) ON CONFLICT DO NOTHING",
+                recognized,
+            )
+    for (method, properties, _), latex in zip(accepted, results):
+        if latex is None:
+            reject(ch, method, properties, "failed")
+        else:
+            reply(ch, properties, latex)
+            ch.basic_ack(method.delivery_tag)
+
+
+def consume_images():
+    """
+    Collect screenshots into batches of up to `OCR_BATCH_SIZE` messages. A batch is recognized once it is full
+    or `OCR_BATCH_WAIT` milliseconds after its first message arrived.
+    """
+    connection, channel = connect_to_rabbitmq()
+    declare_queue(channel, AI_LATEX_OCR_QUEUE)
+    channel.basic_qos(prefetch_count=OCR_BATCH_SIZE)
+    wait = OCR_BATCH_WAIT / 1000
+    batch, deadline = [], 0.0
+    for method, properties, body in channel.consume(AI_LATEX_OCR_QUEUE, inactivity_timeout=wait):
+        if method is not None:
+            if not batch:
+                deadline = time.monotonic() + wait
+            batch.append((method, properties, body))
+        if batch and (len(batch) >= OCR_BATCH_SIZE or time.monotonic() >= deadline):
+            process_images(channel, batch)
+            batch = []
+
+
+def supervise(consumers: list[tuple[str, callable, int]]):
+    """
+    Run every consumer in the given amount of forked processes and restart processes that exit.
+
+    :param consumers: List of (name, consumer function, amount of processes) triples
+    """
+    context = multiprocessing.get_context("fork")
+    processes = {}
+
+    def start(name, target):
+        # Not daemonic, PDF consumers start processes of their own
+        process = context.Process(target=target, name=name)
+        process.start()
+        processes[process.sentinel] = (process, target)
+
+    for name, target, count in consumers:
+        for _ in range(count):
+            start(name, target)
+    while True:
+        for sentinel in multiprocessing.connection.wait(list(processes)):
+            process, target = processes.pop(sentinel)
+            multiprocess.mark_process_dead(process.pid)
+            print(f"Consumer {process.name} ({process.pid}) exited with code {process.exitcode}, restarting")
+            time.sleep(1)
+            start(process.name, target)
 
-def process_image(ch: pika.adapters.blocking_connection.BlockingChannel, _method, properties, body):
-    img = Image.open(BytesIO(body))
-    latex = model(img)
-    ch.basic_publish(exchange='', routing_key=properties.reply_to, body=latex.encode("utf-8"))
 
 def main():
-    client.pull(OLLAMA_MODEL)
+    global model
+    print("Please, wait! Models are now loading (it will load models from hf.co on the first startup, next loadings will be much faster since they will be loaded from disk.")
+    model = LatexOCR()
+    load_pdf_models()
+    print("Done loading models!")
+    pull_model()
     print('Worker is waiting for messages. To exit press CTRL+C')
-    connection, channel = connect_to_rabbitmq()
-    channel.queue_declare(queue=AI_PDF_QUEUE)
-    channel.queue_declare(queue=AI_LATEX_OCR_QUEUE)
-    channel.basic_consume(queue=AI_PDF_QUEUE, on_message_callback=process_pdf, auto_ack=True)
-    channel.basic_consume(queue=AI_LATEX_OCR_QUEUE, on_message_callback=process_image, auto_ack=True)
-    channel.start_consuming()
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    start_http_server(METRICS_PORT, registry=registry)
+    supervise([
+        ("ocr", consume_images, OCR_CONSUMERS),
+        ("pdf", consume_pdfs, PDF_CONSUMERS),
+    ])
 
 if __name__ == '__main__':
     main()